@@ -58,13 +58,13 @@ def init_cf(lockfile):
     return find_connection_file(kid)
 
 
-def with_daemon(lockfile, pidfile, cmd):
-    """ Launch daemon. """
+def with_daemon(lockfile, cmd):
+    """ Launch daemon. kd5 returns once the daemon serves. """
 
-    os.system(cmd)
-
-    while os.path.exists(pidfile) is False:
-        time.sleep(0.1)
+    if os.system(cmd) != 0:
+        message = '{}Error :{}\tkd5 did not start ! See ~/.cpyvke/kd5.log\n'
+        sys.stderr.write(message.format(RED, RESET))
+        sys.exit(1)
 
     return init_cf(lockfile)
 
@@ -118,7 +118,7 @@ def parse_args(lockfile, pidfile):
 
     elif args.integer == 'last' and os.path.exists(lockfile):
         cmd = 'kd5 last'
-        cf = with_daemon(lockfile, pidfile, cmd)
+        cf = with_daemon(lockfile, cmd)
 
     elif args.integer:
         try:
@@ -129,11 +129,11 @@ def parse_args(lockfile, pidfile):
             sys.exit(1)
         else:
             cmd = 'kd5 start ' + str(args.integer)
-        cf = with_daemon(lockfile, pidfile, cmd)
+        cf = with_daemon(lockfile, cmd)
 
     else:
         cmd = 'kd5 start'
-        cf = with_daemon(lockfile, pidfile, cmd)
+        cf = with_daemon(lockfile, cmd)
 
     return args, cf
 
@@ -164,14 +164,19 @@ def main(args=None):
     logger.addHandler(handler)
 
     # Parse arguments
+    start = time.monotonic()
     args, cf = parse_args(lockfile, pidfile)
+    daemon_ready = time.monotonic()
 
     # Init kernel
     km, kc = connect_kernel(cf)
+    connected = time.monotonic()
 
     # Init Curses App
     sock = SocketManager(config, logger)
-    app = InitApp(kc, cf, config, sock)
+    app = InitApp(kc, cf, config, sock, started=start)
+    logger.info('Startup :: daemon {:.3f} s, kernel {:.3f} s, interface {:.3f} s'.format(
+        daemon_ready - start, connected - daemon_ready, time.monotonic() - connected))
     # Run App
     logger.info('cpyvke started')
     main_curse = MainWin(app, sock, logger)
@@ -36,7 +36,6 @@ import traceback
 import curses
 
 from cpyvke.utils.colors import Colors
-from cpyvke.utils.comm import send_msg
 from cpyvke.utils.display import str_reduce
 
 locale.setlocale(locale.LC_ALL, '')
@@ -82,7 +81,7 @@ def check_size(function):
 class InitApp:
     """ Initlication. """
 
-    def __init__(self, kc, cf, config, sock):
+    def __init__(self, kc, cf, config, sock, started=None):
         """  """
 
         # Arguments
@@ -90,6 +89,8 @@ class InitApp:
         self.cf = cf
         self.config = config
         self.sock = sock
+        # Start of cpyvke (time.monotonic) until the first namespace is shown
+        self.started = started
 
         # Init CUI :
         self.close_signal = 'continue'
@@ -119,6 +120,7 @@ class InitApp:
         self.explorer_switch = False
         self.kernel_switch = False
         self.var_nb = 0
+        self.var_age = None
 
     @property
     def screen_width(self):
@@ -242,6 +244,8 @@ class InitApp:
 
         debug_info_id = 'kernel {} '.format(self.cf.split('-')[1].split('.')[0])
         debug_info_obj = '{} obj.'.format(self.var_nb)
+        if self.var_age is not None:
+            debug_info_obj += ' ({})'.format(self.format_age(self.var_age))
 
         # Kernel Info
         if self.config['font']['pw-font'] == 'True':
@@ -280,6 +284,19 @@ class InitApp:
             self.stdscr.addstr(self.screen_height-2, self.screen_width-10,
                                '< ?:help >', self.c_bar_hlp | curses.A_BOLD)
 
+    @staticmethod
+    def format_age(age):
+        """ Short form of the age (s) of the namespace shown """
+
+        if age < 10:
+            return '{:.1f}s'.format(age)
+        elif age < 60:
+            return '{:.0f}s'.format(age)
+        elif age < 3600:
+            return '{:.0f}min'.format(age/60)
+
+        return '{:.0f}h'.format(age/3600)
+
     def shutdown(self):
         """ Shutdown CUI, Daemon, and kernel """
 
@@ -289,10 +306,11 @@ class InitApp:
             print('Exiting ! Closing cpyvke...')
         elif self.close_signal == 'shutdown':
             print('Exiting ! Shutting down daemon...')
-            send_msg(self.sock.RequestSock, '<_stop>')
+            self.sock.request('stop', wait_reply=False)
 
         self.kc.stop_channels()
         self.sock.close_sockets()
+        self.kernel_win.registry.close()
         self.kill_all_figs()   # Stop all figure subprocesses
 
     @staticmethod
@@ -31,11 +31,11 @@ DOCSTRING
 import curses
 import locale
 from curses import panel
+from time import monotonic
 
 from cpyvke.curseswin.classwin import ClassWin
 from cpyvke.curseswin.widgets import Viewer
-from cpyvke.utils.display import whos_to_dic
-from cpyvke.utils.comm import recv_msg
+from cpyvke.utils.namespace import Namespace
 from cpyvke.utils.inspector import ProceedInspection, Inspect
 from cpyvke.objects.panel import ListPanel
 
@@ -49,6 +49,7 @@ class ExplorerWin(ListPanel):
 
     def __init__(self, app, sock, logger):
         super(ExplorerWin, self).__init__(app, sock, logger)
+        self.namespace = Namespace()
 
     @property
     def panel_name(self):
@@ -77,8 +78,9 @@ class ExplorerWin(ListPanel):
     def custom_tasks(self):
         """ Additional Explorer tasks """
 
-        # Update variable number in bottom bar:
+        # Update variable number and age of the namespace in bottom bar:
         self.app.var_nb = len(self.item_dic)
+        self.app.var_age = self.namespace.age
 
     def custom_key_bindings(self):
         """ Key Actions ! """
@@ -95,25 +97,28 @@ class ExplorerWin(ListPanel):
         """ Get variable from the daemon """
 
         try:
-            tmp = recv_msg(self.sock.MainSock).decode('utf8')
-        except BlockingIOError:     # If no message !
-            pass
+            updates = self.sock.updates()
         except OSError:             # If user disconnect cpyvke from socket
-            pass
+            updates = []
         except AttributeError:      # If kd5 is stopped
-            pass
-        else:
-            if tmp:
-                self.item_dic = whos_to_dic(tmp)
-                self.logger.info('Variable list updated')
+            updates = []
+
+        for tmp in updates:
+            if self.namespace.apply(tmp):
+                self.logger.info('Variable list updated (version {})'.format(self.namespace.version))
                 self.logger.debug('\n%s', tmp)
-                try:
-                    # remove temporary file used by daemon from the list
-                    del self.item_dic['fcpyvke0']
-                except KeyError:
-                    pass
+                if self.namespace.latency is not None:
+                    self.sock.latencies.append(self.namespace.latency)
+                if self.app.started is not None:
+                    self.logger.info('Startup :: first namespace after {:.3f} s'.format(
+                        monotonic() - self.app.started))
+                    self.app.started = None
+            else:
+                self.logger.info('Variable list out of sync : resync')
+                self.sock.resync()
+                break
 
-        return self.item_dic
+        return self.namespace.variables
 
     def menu_special_init(self):
         """ Additionnal menu init """
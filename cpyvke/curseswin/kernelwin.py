@@ -30,18 +30,27 @@ DOCSTRING
 
 import os
 import curses
-from cpyvke.utils.kernel import kernel_dic, start_new_kernel, \
-    shutdown_kernel, connect_kernel
-from cpyvke.utils.comm import send_msg
+from cpyvke.utils.kernel import start_new_kernel, shutdown_kernel, connect_kernel
+from cpyvke.utils.registry import KernelRegistry
 from cpyvke.objects.panel import ListPanel
 
 
+# Time kd5 has to hand out a kernel (s) : it starts one if its pool is empty
+NEW_KERNEL_TIMEOUT = 30
+
+
 class KernelWin(ListPanel):
     """ Kernel manager panel """
 
     def __init__(self, app, sock, logger):
         super(KernelWin, self).__init__(app, sock, logger)
 
+        # Kernels are only listed again when the registry says they changed
+        self.registry = KernelRegistry()
+        self.registry.subscribe(self.kernels_changed)
+        self.kernels = None
+        self.kernels_cf = None
+
     @property
     def panel_name(self):
         return 'kernel-manager'
@@ -72,12 +81,22 @@ class KernelWin(ListPanel):
         elif item == 'pwf':
             return self.app.c_kern_pwf | curses.A_BOLD
 
+    def kernels_changed(self, registry):
+        """ Registry callback : list kernels again """
+
+        self.kernels = None
+
     def get_items(self):
         """ Get items ! """
 
         self.app.cf = self.app.kc.connection_file
+        self.registry.poll()
+
+        if self.kernels is None or self.kernels_cf != self.app.cf:
+            self.kernels = self.registry.kernel_dic(self.app.cf)
+            self.kernels_cf = self.app.cf
 
-        return kernel_dic(self.app.cf)
+        return self.kernels
 
     def custom_key_bindings(self):
         """ Key actions """
@@ -113,21 +132,43 @@ class KernelWin(ListPanel):
                     ('Remove all died', 'self._rm_all_cf()'),
                     ('Shutdown all alive', 'self._kill_all_k()')]
 
+        elif self.item_dic[self.selected]['type'] == 'Pending':
+            return [('New', 'self._new_k()'),
+                    ('Remove all died', 'self._rm_all_cf()'),
+                    ('Shutdown all alive', 'self._kill_all_k()')]
+
         else:
             return []
 
     def _new_k(self):
-        """ Create a new kernel. """
+        """ Create a new kernel. kd5 hands out one of its spare kernels. """
+
+        version = self.app.config['kernel version']['version']
+        reply = None
+
+        if self.sock.connected:
+            try:
+                reply = self.sock.reply(self.sock.request('new'), timeout=NEW_KERNEL_TIMEOUT)
+            except OSError:
+                self.logger.error('New kernel :', exc_info=True)
+
+        if reply and reply['status'] == 'ok':
+            kid = reply['kid']
+        else:
+            try:
+                kid = start_new_kernel(version=version)
+            except RuntimeError:
+                self.logger.error('New kernel :', exc_info=True)
+                self.app.wng.display('Kernel did not start !')
+                return
 
-        kid = start_new_kernel(version=self.app.config['kernel version']['version'])
-        self.app.wng.display('Kernel id {} created (Python {})'.format(kid,
-                                                                       self.app.config['kernel version']['version']))
+        self.app.wng.display('Kernel id {} created (Python {})'.format(kid, version))
 
     def _connect_k(self):
         """ Connect to a kernel. """
 
         km, self.app.kc = connect_kernel(self.item_dic[self.selected]['value'])
-        send_msg(self.sock.RequestSock, '<cf>' + self.item_dic[self.selected]['value'])
+        self.sock.subscribe(self.item_dic[self.selected]['value'])
 
         # Update kernels connection file and set new kernel flag
         self.app.cf = self.app.kc.connection_file
@@ -144,6 +185,7 @@ class KernelWin(ListPanel):
         """ Kill kernel. """
 
         shutdown_kernel(self.item_dic[self.selected]['value'])
+        self.registry.expire()
         self.position = 1
         self.page = 1
 
@@ -153,6 +195,7 @@ class KernelWin(ListPanel):
         for name in self.item_dic:
             if self.item_dic[name]['type'] == 'Alive':
                 shutdown_kernel(self.item_dic[name]['value'])
+        self.registry.expire()
         self.page = 1
         self.position = 1  # Reinit cursor location
 
@@ -30,272 +30,1147 @@ DOCSTRING
 
 import os
 import sys
-import threading
-import socket
+import ast
+import json
+import signal
+import asyncio
 import argparse
 import logging
 import psutil
-from time import sleep
-from queue import Queue
+from time import monotonic
+from itertools import count
+from collections import deque
 from logging.handlers import RotatingFileHandler
-from jupyter_client import find_connection_file
+from jupyter_client import find_connection_file, AsyncKernelClient
 
 from .utils.kernel import init_kernel, connect_kernel, print_kernel_list, \
-    start_new_kernel, set_kid
-from .utils.kd import is_kd_running, find_lost_pid, kdwrite, kdread
-from .utils.comm import send_msg, recv_msg
+    start_new_kernel, set_kid, kernel_list, new_connection_file, kernel_command, \
+    are_running, is_runing
+from .utils.kd import is_kd_running, find_lost_pid, kdwrite, kdread, read_pool, \
+    write_pool, POOL_FILE
+from .utils.comm import frame, decode, binary_header, unix_transport, unix_path, \
+    connect, send_msg, recv_msg, HEADER, CODECS, THRESHOLD, TIMEOUT
+from .utils.metrics import Metrics, write_prometheus, report, percentile
+from .utils.namespace import Snapshot
 from .utils.daemon3x import Daemon
 from .utils.config import cfg_setup
 from .utils.term_colors import RED, BLUE, CYAN, RESET
 
 logger = logging.getLogger('kd5')
+metrics = Metrics()
 
+# Bytes of an array read from the agent at once
+CHUNK = 1 << 20
 
-class Watcher(threading.Thread):
+# Time a kernel has to be connected and to give its namespace (s)
+WATCH_TIMEOUT = 30
+
+# Seconds between two writes of the metrics file
+METRICS_INTERVAL = 10
+
+# Seconds between two logs of the end-to-end latency, and samples kept
+LATENCY_INTERVAL = 60
+LATENCY_SAMPLES = 1000
+
+# Time a spare kernel has to start and be initialized (s)
+POOL_TIMEOUT = 60
+
+# Time a spare kernel has to answer a shutdown request (s)
+SHUTDOWN_TIMEOUT = 5
+
+
+async def read_frame(reader):
+    """ (flags, payload) of the next frame or None if EOF is hit """
+
+    try:
+        length, flags = HEADER.unpack(await reader.readexactly(HEADER.size))
+        return flags, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def disp_id(data):
+    """ Display first seq of message id only """
+    return data['parent_header'].get('msg_id', '').split('-')[0]
+
+
+def disp_data(data):
+    if data['msg_type'] == 'status':
+        dbg = '{} | status : {}'.format(disp_id(data), data['content']['execution_state'])
+    elif data['msg_type'] == 'execute_input':
+        dbg = '{} | code : {}'.format(disp_id(data), data['content']['code'])
+    elif data['msg_type'] == 'stream':
+        dbg = '{} | stream'.format(disp_id(data))
+    elif data['msg_type'] == 'error':
+        dbg = '{} | error : {}'.format(disp_id(data), data['content']['ename'])
+    else:
+        dbg = '{} {}'.format(disp_id(data), data['msg_type'])
+    return dbg
+
+
+class Client:
+    """ Connection of a client, with its own outbound queue of frames.
+    A task writes the queue to the socket as fast as the client reads it.
+
+    A slow or suspended client never holds the daemon : namespace frames it
+    has not read yet are superseded by the next update (see
+    KernelWatch.broadcast) and array transfers wait while more than
+    HIGH_WATER bytes are queued. """
+
+    # Array transfers wait while more bytes are queued
+    HIGH_WATER = 4*CHUNK
+
+    # Client ids, used as metric labels
+    ids = count(1)
+
+    def __init__(self, reader, writer):
+
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername') or writer.get_extra_info('sockname')
+        self.id = next(self.ids)
+        # Compression negotiated by the hello message
+        self.codec = None
+        self.threshold = THRESHOLD
+        # Kernel the client subscribed to (main client)
+        self.kernel = None
+        # Future of the kernel the requests apply to, once the kernel changes
+        # asked before them are done (request client)
+        self.selected = None
+        # (kind, frame) not written yet and their size
+        self.queue = deque()
+        self.queued = 0
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.drained.set()
+        # Connection handler and requests being handled
+        self.handler = asyncio.current_task()
+        self.tasks = set()
+        self.sender = asyncio.ensure_future(self.send_loop())
+
+    def negotiate(self, hello, threshold):
+        """ Pick the first codec offered by **hello** that kd5 knows.
+        Return the welcome message. """
+
+        self.codec = next((c for c in hello.get('codecs', []) if c in CODECS), None)
+        self.threshold = threshold
+
+        return json.dumps({'type': 'welcome', 'codec': self.codec})
+
+    def encode(self, msg):
+        """ Frame **msg** with the codec of this client """
+
+        return frame(msg, codec=self.codec, threshold=self.threshold)
+
+    def push(self, frame, kind=None):
+        """ Queue a frame. The same frame can be pushed to several clients.
+        **kind** marks frames which can be superseded. """
+
+        self.queue.append((kind, frame))
+        self.queued += len(frame)
+        self.ready.set()
+        if self.queued > self.HIGH_WATER:
+            self.drained.clear()
+
+    def supersede(self, kind):
+        """ Drop the queued frames of **kind**. Return how many were dropped. """
+
+        kept = deque(item for item in self.queue if item[0] != kind)
+        dropped = len(self.queue) - len(kept)
+        if dropped:
+            self.queue = kept
+            self.queued = sum(len(item[1]) for item in kept)
+            self.dropped += dropped
+            metrics.inc('frames_dropped', dropped)
+            if self.queued <= self.HIGH_WATER//2:
+                self.drained.set()
+
+        return dropped
+
+    async def send_loop(self):
+        """ Write the queue. The connection is closed if the client is gone. """
+
+        try:
+            while True:
+                await self.ready.wait()
+                while self.queue:
+                    data = self.queue.popleft()[1]
+                    self.queued -= len(data)
+                    self.writer.write(data)
+                    metrics.inc('bytes_sent', len(data), client=self.id)
+                    if self.queued <= self.HIGH_WATER//2:
+                        self.drained.set()
+                    await self.writer.drain()
+                self.ready.clear()
+        except ConnectionError:
+            self.writer.close()
+
+    def close(self):
+        """ Stop sending and handling requests. Close the connection. """
+
+        self.sender.cancel()
+        for task in self.tasks:
+            task.cancel()
+        self.writer.close()
+
+
+def agent_path(kid):
+    """ Unix socket of the agent of kernel **kid** """
+
+    return os.path.expanduser("~") + "/.cpyvke/agent-{}.sock".format(kid)
+
+
+def task_done(task):
+    """ Log the exception that ended **task** """
+
+    if not task.cancelled() and task.exception():
+        logger.error('Task failed', exc_info=task.exception())
+
+
+def spawn(coro, tasks):
+    """ Run **coro** in a task kept in the set **tasks** until it is done """
+
+    task = asyncio.ensure_future(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    task.add_done_callback(task_done)
+
+    return task
+
+
+class KernelWatch:
+    """
+    Live connection to one kernel : its channels, its agent and the last
+    snapshot of its namespace, sent to the main clients subscribed to it.
+
+    While a cell is running, variables are refreshed every **busy_refresh**
+    seconds. Only the end (idle status) of a user execution triggers a
+    refresh. The refreshes requested within **debounce** seconds are merged
+    into one.
     """
-    Daemon : watch the kernel input and update variable list.
+
+    def __init__(self, cf, busy_refresh=1., debounce=0.05):
+
+        self.cf = cf
+        self.kid = set_kid(cf)
+        self.busy_refresh = busy_refresh
+        self.debounce = debounce
+
+        self.km = None
+        self.kc = None
+        self.tasks = set()
+        self.executing = set()
+        self.own_msgs = set()
+        self.pending = {}
+        self.refresh_handle = None
+        self.snapshot = Snapshot()
+        self.subscribers = []
+        self.agent = None
+        self.agent_path = None
+
+        # Loop objects must be created in the running loop
+        self.started = asyncio.Event()
+        self.busy_event = asyncio.Event()
+        self.refresh_lock = asyncio.Lock()
+        self.attach_lock = asyncio.Lock()
+
+    async def start(self):
+        """ Connect to the kernel and read its namespace """
+
+        start = monotonic()
+        self.km, self.kc = connect_kernel(self.cf, client_class=AsyncKernelClient, init=False)
+        self.kc.start_channels()
+        self.init()
+        spawn(self.watch_kernel(), self.tasks)
+        spawn(self.watch_shell(), self.tasks)
+        spawn(self.watch_busy(), self.tasks)
+        connected = monotonic()
+        await self.attach_agent()
+        attached = monotonic()
+
+        self.snapshot.update(**await self.get_variables())
+        self.started.set()
+        logger.info('Watching kernel {} ({} variables) in {:.3f} s (connect {:.3f} s, agent {:.3f} s, snapshot {:.3f} s)'.format(
+            self.kid, len(self.snapshot.variables), monotonic() - start,
+            connected - start, attached - connected, monotonic() - attached))
+
+    def stop(self):
+        """ Stop watching the kernel """
+
+        for task in self.tasks:
+            task.cancel()
+
+        # Replies of this kernel will never come
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('Kernel not watched anymore'))
+        self.pending.clear()
+
+        if self.refresh_handle:
+            self.refresh_handle.cancel()
+        self.close_agent()
+        if self.kc:
+            self.kc.stop_channels()
+
+    @property
+    def busy(self):
+        """ A user execution is running """
+
+        return bool(self.executing)
+
+    def subscribe(self, client):
+        """ Send the namespace of this kernel to **client** from now on """
+
+        self.subscribers.append(client)
+        client.supersede('namespace')
+        client.push(client.encode(self.snapshot.full()), 'namespace')
+
+    def broadcast(self, msg):
+        """ Frame **msg** once per codec and send it to every subscribed client.
+        A client which did not read the previous update yet gets a full
+        snapshot in place of all its pending updates. """
+
+        frames = {}
+        for client in self.subscribers:
+            late = bool(client.supersede('namespace'))
+            if late:
+                logger.debug('{} is late : full snapshot sent'.format(client.address))
+            key = (client.codec, late)
+            if key not in frames:
+                frames[key] = client.encode(self.snapshot.full() if late else msg)
+            client.push(frames[key], 'namespace')
+
+        if self.snapshot.captured is not None:
+            metrics.observe('publish_seconds', monotonic() - self.snapshot.captured)
+        logger.info('Variable list of {} sent to {} client(s) (version {})'.format(
+            self.kid, len(self.subscribers), self.snapshot.version))
+
+    async def watch_busy(self):
+        """ Refresh the variables periodically while a user execution is
+        running. The agent can be asked while the kernel is busy. """
+
+        while True:
+            await self.busy_event.wait()
+            await asyncio.sleep(self.busy_refresh)
+            if self.busy and not self.agent:
+                # The agent server is not started while the kernel is busy
+                await self.attach_agent(serve=False)
+            if self.busy and self.agent:
+                await self.send_variables()
+
+    def schedule_refresh(self):
+        """ Refresh the variables at the end of the debounce window.
+        Requests made during the window are merged. """
+
+        if self.refresh_handle is None:
+            loop = asyncio.get_event_loop()
+            self.refresh_handle = loop.call_later(self.debounce, self.refresh)
+
+    def refresh(self):
+        """ Debounce window is over """
+
+        self.refresh_handle = None
+        spawn(self.send_variables(), self.tasks)
+
+    async def watch_kernel(self):
+        """ Kernel produced some output : update variables if needed. """
+
+        while True:
+            self.check_input(await self.kc.get_iopub_msg())
+            metrics.inc('iopub_messages', kernel=self.kid)
+
+    def check_input(self, data):
+        """ Check an iopub msg. Messages caused by the daemon own executions are
+        dropped. Idle status following a user execute_input schedules a
+        refresh : stream outputs and other busy/idle cycles (kernel info,
+        completion...) do not. """
+
+        parent = data['parent_header'].get('msg_id')
+        if parent in self.own_msgs:
+            if data['msg_type'] == 'status' and \
+                    data['content']['execution_state'] == 'idle':
+                self.own_msgs.discard(parent)
+            return
+
+        logger.debug('WATCHING {} : {}'.format(self.kid, disp_data(data)))
+
+        if data['msg_type'] == 'execute_input':
+            self.executing.add(parent)
+            self.busy_event.set()
+            self.check_reset(data['content']['code'])
+
+        elif data['msg_type'] == 'status' and parent in self.executing and \
+                data['content']['execution_state'] == 'idle':
+            self.executing.discard(parent)
+            if not self.executing:
+                self.busy_event.clear()
+            self.schedule_refresh()
+
+    def check_reset(self, code):
+        """ Namespace reset also removes the daemon imports """
+
+        if 'reset' in code:
+            self.init()
+            logger.debug('RESET RECEIVED : {}'.format('Init Kernel'))
+
+    def init(self):
+        """ Import the daemon modules in the kernel (see init_kernel). These
+        executions are not user ones. """
+
+        self.own_msgs.update(init_kernel(self.kc))
+
+    def submit(self, code, expressions=None):
+        """ Execute **code** silently. **expressions** are evaluated by the
+        kernel after **code** (user_expressions). Return a future of the
+        content of the execute_reply. """
+
+        msg_id = self.kc.execute(code, silent=True, store_history=False,
+                                 user_expressions=expressions or {})
+        self.own_msgs.add(msg_id)
+        future = asyncio.get_event_loop().create_future()
+        self.pending[msg_id] = future
+        logger.debug("EXEC : '{}' sent with id {}".format(code, msg_id.split('-')[0]))
+
+        return future
+
+    async def execute(self, code, expressions=None):
+        """ Execute **code** and wait for its execute_reply (see submit) """
+
+        content = await self.submit(code, expressions)
+        if content['status'] != 'ok':
+            logger.error('EXEC : {} : {}'.format(content['status'], content.get('ename')))
+
+        return content
+
+    async def watch_shell(self):
+        """ Resolve the future waiting for each execute_reply """
+
+        while True:
+            reply = await self.kc.get_shell_msg()
+            # Replies to init_kernel are not waited for
+            future = self.pending.pop(reply['parent_header'].get('msg_id'), None)
+            if future and not future.done():
+                future.set_result(reply['content'])
+
+    @staticmethod
+    def expression(content, name):
+        """ text/plain representation of the user expression **name** """
+
+        result = content.get('user_expressions', {}).get(name, {})
+        if result.get('status') != 'ok':
+            return None
+
+        return result['data']['text/plain']
+
+    async def attach_agent(self, serve=True):
+        """ Connect to the kernel agent, if not connected yet. Start its server
+        if needed and **serve** is True. """
+
+        path = agent_path(self.kid)
+
+        async with self.attach_lock:
+            if self.agent:
+                return
+            try:
+                self.agent = await asyncio.open_unix_connection(path)
+            except OSError:
+                if not serve:
+                    return
+                await self.execute("_agent.serve('{}')".format(path))
+                try:
+                    self.agent = await asyncio.open_unix_connection(path)
+                except OSError:
+                    logger.error('Cannot connect to kernel agent', exc_info=True)
+                    return
+
+            self.agent_path = path
+            logger.info('Connected to kernel agent : {}'.format(path))
+
+    def close_agent(self):
+        """ Close the connection to the kernel agent """
+
+        if self.agent:
+            self.agent[1].close()
+        self.agent = None
+        self.agent_path = None
+
+    async def get_variables(self):
+        """ Ask the kernel agent for the namespace records, with the execution
+        count and the time of the scan (see agent.snapshot). Raise RuntimeError
+        if the kernel cannot import the agent. """
+
+        start = monotonic()
+
+        # Connection lost by a previous scan
+        await self.attach_agent()
+
+        if self.agent:
+            reader, writer = self.agent
+            try:
+                writer.write(frame('snapshot'))
+                msg = await asyncio.wait_for(read_frame(reader), 10)
+                if msg is None:
+                    raise ConnectionError('Kernel agent closed')
+                variables = json.loads(msg[1].decode('utf8'))
+                metrics.observe('snapshot_seconds', monotonic() - start, source='agent')
+                return variables
+            except (OSError, asyncio.TimeoutError):
+                logger.error('Kernel agent lost : use execute, connect again at next scan',
+                             exc_info=True)
+                self.close_agent()
+
+        expr = {'ns': '_agent.snapshot()'}
+        raw = self.expression(await self.execute('', expr), 'ns')
+        if raw is None:
+            # Namespace may have been reset since the agent was imported
+            logger.debug("EXEC : snapshot returned nothing : init kernel and RUN AGAIN")
+            self.init()
+            raw = self.expression(await self.execute('', expr), 'ns')
+        if raw is None:
+            raise RuntimeError('No agent in kernel {} : cpyvke cannot be imported '
+                               'from its environment'.format(self.kid))
+
+        variables = json.loads(ast.literal_eval(raw))
+        metrics.observe('snapshot_seconds', monotonic() - start, source='execute')
+        return variables
+
+    async def send_variables(self):
+        """ Send the changes of the namespace to subscribed clients """
+
+        async with self.refresh_lock:
+            delta = self.snapshot.update(**await self.get_variables())
+            if delta is None:
+                logger.debug('Namespace of {} unchanged'.format(self.kid))
+            else:
+                self.broadcast(delta)
+
+    async def ask_agent(self, request):
+        """ Send **request** to the agent on a new connection.
+        Return (header, connection). The header is {'error': ...} on failure. """
+
+        # Connection lost by a scan
+        await self.attach_agent()
+        if not self.agent_path:
+            return {'error': 'No kernel agent'}, None
+
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.agent_path)
+        except OSError:
+            logger.error('Kernel agent unreachable', exc_info=True)
+            return {'error': 'Kernel agent lost'}, None
+
+        try:
+            writer.write(frame(request))
+            msg = await asyncio.wait_for(read_frame(reader), 10)
+            header = json.loads(msg[1].decode('utf8'))
+        except (OSError, TypeError, ValueError, asyncio.TimeoutError):
+            logger.error('Kernel agent did not answer {}'.format(request), exc_info=True)
+            writer.close()
+            return {'error': 'Kernel agent lost'}, None
+
+        if 'error' in header:
+            writer.close()
+            return header, None
+
+        return header, (reader, writer)
+
+
+class KernelPool:
+    """
+    Spare kernels, started and initialized in advance : a new kernel is handed
+    out at once. The pool is refilled to **size** kernels in the background.
+
+    Spare kernels, and the kernels being started, are listed in **path** :
+    they are hidden from the kernel lists. Spare kernels outlive the daemon :
+    'kd5 start' takes one of them (see spare_kernel) and the next daemon adopts
+    the others.
+    """
+
+    def __init__(self, size, path=POOL_FILE, version=3):
+
+        self.size = size
+        self.path = path
+        self.version = version
+        self.kernels = deque()
+        self.starting = 0
+        # Ids of the kernels being started
+        self.warming = set()
+        self.tasks = set()
+        self.changed = asyncio.Event()
+
+    async def load(self):
+        """ Adopt the spare kernels of the pool file which are still alive.
+        Those beyond the size of the pool are shut down. """
+
+        cfs = []
+        for kid in read_pool(self.path):
+            try:
+                cfs.append(find_connection_file(kid))
+            except OSError:
+                continue
+
+        alive = await asyncio.get_running_loop().run_in_executor(None, are_running, cfs)
+        cfs = [cf for cf, up in zip(cfs, alive) if up]
+        self.kernels.extend(set_kid(cf) for cf in cfs[:self.size])
+        logger.info('Kernel pool : {} spare kernel(s) adopted, {} shut down'.format(
+            len(self.kernels), len(cfs[self.size:])))
+        self.save()
+
+        for cf in cfs[self.size:]:
+            spawn(self.shutdown(cf), self.tasks)
+        self.fill()
+
+    async def shutdown(self, cf):
+        """ Shut the spare kernel of **cf** down and remove its connection file """
+
+        kc = AsyncKernelClient()
+        kc.load_connection_file(cf)
+        kc.start_channels()
+        try:
+            await kc.shutdown(reply=True, timeout=SHUTDOWN_TIMEOUT)
+        except (OSError, RuntimeError):
+            logger.error('Spare kernel {} did not shut down'.format(set_kid(cf)), exc_info=True)
+            return
+        finally:
+            kc.stop_channels()
+
+        # The kernel did not write its connection file (see new_connection_file)
+        if os.path.exists(cf):
+            os.remove(cf)
+        logger.info('Spare kernel {} shut down'.format(set_kid(cf)))
+
+    def save(self):
+        """ Update the pool file """
+
+        try:
+            write_pool(self.path, list(self.kernels) + sorted(self.warming))
+        except OSError:
+            logger.error('Cannot write pool file', exc_info=True)
+
+    def fill(self):
+        """ Start kernels until the pool is full """
+
+        while len(self.kernels) + self.starting < self.size:
+            self.starting += 1
+            spawn(self.warm(), self.tasks)
+
+    async def warm(self):
+        """ Add a new kernel to the pool. self.starting is counted by the caller. """
+
+        start = monotonic()
+        try:
+            kid = await asyncio.wait_for(self.start_kernel(), POOL_TIMEOUT)
+        except Exception:
+            logger.error('Cannot start a spare kernel', exc_info=True)
+            kid = None
+        finally:
+            self.starting -= 1
+
+        if kid:
+            metrics.observe('kernel_start_seconds', monotonic() - start)
+            self.kernels.append(kid)
+        self.save()
+
+        self.changed.set()
+
+    async def start_kernel(self):
+        """ Start a kernel and initialize it. Return its id. """
+
+        start = monotonic()
+        kid, cf = new_connection_file()
+        self.warming.add(kid)
+        self.save()
+        process = None
+        kc = AsyncKernelClient()
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *kernel_command(cf, self.version), stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+                start_new_session=True)
+            launched = monotonic()
+            kc.load_connection_file(cf)
+            kc.start_channels()
+            # A kernel busy starting may miss heartbeats : only its exit is final
+            while True:
+                try:
+                    await kc.wait_for_ready(timeout=1)
+                    break
+                except RuntimeError:
+                    if process.returncode is not None:
+                        raise ConnectionError('Kernel exited with {}'.format(process.returncode))
+            answered = monotonic()
+
+            init_kernel(kc)
+            msg_id = kc.execute("_agent.serve('{}')".format(agent_path(kid)),
+                                store_history=False)
+            while (await kc.get_shell_msg())['parent_header'].get('msg_id') != msg_id:
+                pass
+
+        except BaseException:
+            if process and process.returncode is None:
+                process.terminate()
+            if os.path.exists(cf):
+                os.remove(cf)
+            raise
+
+        finally:
+            kc.stop_channels()
+            self.warming.discard(kid)
+
+        logger.info('Spare kernel {} ready in {:.3f} s (launch {:.3f} s, kernel_info {:.3f} s, init {:.3f} s)'.format(
+            kid, monotonic() - start, launched - start, answered - launched, monotonic() - answered))
+
+        return kid
+
+    async def take(self):
+        """ Id of a spare kernel. A kernel is started if the pool is empty.
+        Raise ConnectionError if none can be started. """
+
+        started = False
+        while True:
+            while not self.kernels:
+                if not self.starting:
+                    if started:
+                        raise ConnectionError('Cannot start a kernel')
+                    started = True
+                    metrics.inc('pool_misses')
+                    self.starting += 1
+                    spawn(self.warm(), self.tasks)
+                self.changed.clear()
+                await self.changed.wait()
+
+            kid = self.kernels.popleft()
+            self.save()
+
+            # Spare kernels may have been shut down from the kernel manager
+            try:
+                cf = find_connection_file(kid)
+            except OSError:
+                continue
+            if await asyncio.get_running_loop().run_in_executor(None, is_runing, cf):
+                break
+
+        metrics.inc('pool_kernels_taken')
+        self.fill()
+
+        return kid
+
+    def stop(self):
+        """ Stop the kernels being started. Spare kernels are kept. """
+
+        for task in self.tasks:
+            task.cancel()
+
+
+class Watcher:
+    """
+    Daemon : watch the kernels input and update variable lists.
     The client may also request for the content of a variable.
+
+    Kernel channels, client connections and timers are all coroutines of a
+    single asyncio loop : the daemon sleeps until one of them has something
+    for it.
+
+    The namespace of each kernel is read from its agent (see utils/agent.py)
+    which answers even when the kernel is busy.
+
+    Several kernels are watched at once (see KernelWatch) : **kernels** is
+    'current' (kernels are watched once a client switched to them), 'all'
+    (every kernel alive at startup) or a list of kernel ids. A client switching
+    to a watched kernel gets its namespace at once.
+
+    Clients connect through unix sockets in ~/.cpyvke/ (**transport** 'unix')
+    or through tcp sockets bound to the loopback interface ('tcp').
+
+    A client may open each connection with {'type': 'hello', 'codecs': [...]}.
+    kd5 answers {'type': 'welcome', 'codec': ...} and then compresses the
+    frames larger than **threshold** bytes with this codec (FLAG_COMPRESSED).
+    Binary frames of arrays are never compressed. Main clients do not wait
+    for the welcome : frames sent before it are not compressed.
+
+    Any number of clients can connect. Main clients receive the namespace of
+    the kernel they subscribed to. A subscription is changed by sending
+    {'type': 'subscribe', 'cf': ...} on the main socket.
+
+    Arrays are not rendered as text : their buffer is relayed from the agent to
+    the client in binary frames, or published by the agent in shared memory.
+
+    A 'new' request is answered with the id of a spare kernel of the pool
+    (see KernelPool), which keeps **pool** kernels ready.
+
+    Requests are json messages {'id': n, 'type': ..., ...} answered by
+    {'id': n, 'status': ..., ...} on the same connection. They apply to the
+    kernel last selected by a 'kernel' request of the same connection. Each
+    request is handled by its own task, so any number of requests can be in
+    flight.
     """
 
-    def __init__(self, kc, delay=0.1, sport=15557, rport=15556):
+    def __init__(self, cf, sport=15557, rport=15556, busy_refresh=1., debounce=0.05,
+                 kernels='current', transport='unix', threshold=THRESHOLD,
+                 metrics_file=None, pool=0, version=3, ready=None):
         """ Class constructor """
 
         logger.info('++++++++++++++++++++++++++++')
         logger.info('Initialize Watcher')
 
-        # Init Thread
-        threading.Thread.__init__(self)
-        threading.Thread.daemon = True
-
-        logger.info('Watcher sent to thread')
-
-        # Events
-        self._stop = threading.Event()
-        self._pause = threading.Event()
-        logger.info('Events created')
-
         # Inputs
-        self.kc = kc
-        self.delay = delay
+        self.cf = cf
+        self.sport = sport
+        self.rport = rport
+        self.busy_refresh = busy_refresh
+        self.debounce = debounce
+        self.watch_mode = kernels
+        self.transport = transport
+        self.threshold = threshold
+        self.metrics_file = metrics_file
+        self.pool_size = pool
+        self.version = version
+        # Called once the sockets serve
+        self.ready = ready
 
-        # Queue
-        self.kernel_queue = Queue()
-        logger.info('Queue created')
+        # Init variables
+        self.kernels = {}
+        self.main_clients = []
+        self.request_clients = []
+        self.tasks = set()
+        # Kernel scan to client reception times reported by the clients
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.latency_logged = 0
+
+    async def run(self):
+        """ Run the variable explorer daemon """
 
+        start = monotonic()
+        self.stopped = asyncio.Event()
+        # kd5 stop sends SIGTERM : sockets, clients and kernels are closed
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+        self.pool = KernelPool(self.pool_size, version=self.version)
 
-        # Init Main Socket
-        try:
-            self.MainSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.MainSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.MainSock.bind(('', sport))
-            self.MainSock.listen(5)
-            self.MainSock.setblocking(0)
-            self.client_main = None
-            logger.info('Main socket created')
-        except Exception as e:
-            logger.info(e)
-            logger.info('Exiting...')
-            sys.exit(1)
+        # A busy kernel gives its namespace once its cell is done : clients
+        # wait for it, the daemon does not
+        spawn(self.watch_first(self.cf, start), self.tasks)
 
-        # Init Request Socket
         try:
-            self.RequestSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.RequestSock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.RequestSock.bind(('', rport))
-            self.RequestSock.listen(5)
-            self.RequestSock.setblocking(0)
-            self.client_request = None
+            self.MainServer = await self.start_server(self.serve_main, self.sport)
+            logger.info('Main socket created')
+            self.RequestServer = await self.start_server(self.serve_requests, self.rport)
             logger.info('Request socket created')
-        except Exception as e:
+        except OSError as e:
             logger.info(e)
             logger.info('Exiting...')
             sys.exit(1)
 
+        if self.ready:
+            self.ready()
+        logger.info('Startup :: ready in {:.3f} s'.format(monotonic() - start))
+
+        for cf in self.initial_kernels():
+            spawn(self.watch(cf), self.tasks)
+
+        if self.metrics_file:
+            spawn(self.write_metrics(), self.tasks)
+
+        spawn(self.pool.load(), self.tasks)
 
         logger.info('++++++++++++++++++++++++++++')
         logger.info('Daemon started !')
-        logger.info('Delay set to {} s.'.format(self.delay))
-        logger.info('Kernel : {}'.format(self.kc.connection_file))
-        logger.info('Streaming on {}'.format(sport))
-        logger.info('Listening on {}'.format(rport))
+        logger.info('Kernel : {}'.format(self.cf))
+        logger.info('Watching : {}'.format(self.watch_mode))
+        logger.info('Streaming on {}'.format(self.address(self.sport)))
+        logger.info('Listening on {}'.format(self.address(self.rport)))
+        logger.info('Busy refresh set to {} s.'.format(self.busy_refresh))
+        logger.info('Debounce set to {} s.'.format(self.debounce))
+        logger.info('Compression above {} bytes with : {}'.format(self.threshold,
+                                                                 ', '.join(CODECS)))
+        if self.metrics_file:
+            logger.info('Metrics written to {}'.format(self.metrics_file))
+        logger.info('Spare kernels : {}'.format(self.pool.size))
         logger.info('++++++++++++++++++++++++++++')
 
-        # Init variables
-        self.msg = 0
-        self.check_input()
-        self.variables = ''
+        await self.stopped.wait()
 
-    def run(self):
-        """ Run the variable explorer daemon """
+        await self.close()
+        logger.info('Exited')
 
-        # Launch streamer
-        streamer = threading.Thread(target=self.stream_data)
-        streamer.start()
+    async def watch_first(self, cf, start):
+        """ Watch kernel **cf** the daemon was started with. Stop the daemon
+        if it cannot be watched. """
 
-        while True:
+        try:
+            await self.watch(cf, timeout=None)
+        except ConnectionError as e:
+            logger.error(e)
+            logger.info('Exiting...')
+            self.stop()
+            return
 
-            # Look for connection to request socket
-            self.listen_request_sock()
+        logger.info('Startup :: kernel watched in {:.3f} s'.format(monotonic() - start))
 
-            # Watch RequestSock for code request OR kernel changes
-            if self.client_request:
-                self.fetch_request()
+    async def close(self):
+        """ Close connection to clients and destroy sockets. """
 
-            # Terminate daemon
-            if self._stop.isSet():
-                logger.info('Request Socket closed !')
-                break
+        self.MainServer.close()
+        self.RequestServer.close()
+        if unix_transport(self.transport):
+            for port in (self.sport, self.rport):
+                os.remove(unix_path(port))
 
-            sleep(self.delay)
+        # Handlers may be waiting for a kernel busy with a cell
+        clients = self.main_clients + self.request_clients
+        for client in clients:
+            client.close()
+            client.handler.cancel()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*[client.handler for client in clients], *self.tasks,
+                             return_exceptions=True)
 
-        streamer.join()
-        # Close connection to clients
-        self.MainSock.shutdown()
-        self.RequestSock.shutdown()
-        # Destroy socket
-        self.MainSock.close()
-        self.RequestSock.close()
-        logger.info('Exited')
+        for kernel in self.kernels.values():
+            kernel.stop()
 
-    def stream_data(self):
-        """ Stream 'whos' output to client. """
+        self.pool.stop()
 
-        while True:
+        logger.info('Sockets closed !')
 
-            # Pause if client has a request
-            self.pause()
+    def address(self, port):
+        """ Address standing for **port** with the transport in use """
 
-#            # Check if reset has been invoked
-#            if 'empty' in self.variables:
-#                init_kernel(self.kc)
+        if unix_transport(self.transport):
+            return unix_path(port)
 
-            # Look for connection to main socket
-            self.listen_main_sock()
+        return '127.0.0.1:{}'.format(port)
 
-            # Listen to kernel changes
-            if self.kernel_queue.qsize() > 0:
-                self.kernel_change(self.kernel_queue.get())
+    async def start_server(self, handler, port):
+        """ Serve **handler** on **port** (tcp) or on its unix socket.
+        Unix sockets are only accessible to the user. """
 
-            # Check in new entries in kernel
-            self.check_input()
+        if not unix_transport(self.transport):
+            return await asyncio.start_server(handler, '127.0.0.1', port)
 
-            # If new entries, update variables
-            if self.msg == 1:
-                self.send_variables()
+        path = unix_path(port)
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(handler, path)
+        os.chmod(path, 0o600)
 
-            # Terminate daemon
-            if self._stop.isSet():
-                logger.info('Stream Socket closed !')
-                break
+        return server
 
-            sleep(self.delay)
+    def initial_kernels(self):
+        """ Connection files of the kernels to watch besides the current one """
 
-    def pause(self):
-        """ Pause streamer when client has a request. """
+        if self.watch_mode == 'current':
+            return []
 
-        if self._pause.isSet():
+        if self.watch_mode == 'all':
+            return [cf for cf, state in kernel_list() if state == '[Alive]']
 
-            logger.debug('Streamer paused...')
+        cfs = []
+        for kid in self.watch_mode.split(','):
+            try:
+                cfs.append(find_connection_file(kid.strip()))
+            except OSError:
+                logger.error('Cannot find kernel id. {}'.format(kid))
 
-            while self._pause.isSet():
-                sleep(self.delay)
+        return cfs
 
-            logger.debug('Streamer active')
+    async def watch(self, cf, timeout=WATCH_TIMEOUT):
+        """ KernelWatch of connection file **cf**. Start it if needed : it is
+        given up if it is not started within **timeout** s. Raise
+        ConnectionError if the kernel cannot be watched. """
 
-            # Force Update var list
-            self.send_variables()
+        if not isinstance(cf, str) or 'kernel-' not in cf:
+            raise ConnectionError('Unknown kernel {}'.format(cf))
 
-    def check_input(self):
-        """ Check the iopub msgs available """
+        kernel = self.kernels.get(cf)
+        if kernel is None:
+            kernel = self.kernels[cf] = KernelWatch(cf, busy_refresh=self.busy_refresh,
+                                                    debounce=self.debounce)
+            # Started in its own task : the clients waiting for it may leave
+            spawn(self.start_watch(kernel, timeout), self.tasks)
 
-        self.msg = 0
-        while self.kc.iopub_channel.msg_ready():
-            data = self.kc.get_iopub_msg(timeout=0.1)
-            logger.debug('WATCHING : {}'.format(self.disp_data(data)))
-            self.msg = 1
-            self.check_init(data)
+        await kernel.started.wait()
+        if self.kernels.get(cf) is not kernel:
+            raise ConnectionError('Cannot watch kernel {}'.format(kernel.kid))
 
-    def check_init(self, data):
-        if 'code' in data['content'].keys():
-            if 'reset' in data['content']['code']:
-                init_kernel(self.kc)
-                logger.debug('RESET RECEIVED : {}'.format('Init Kernel'))
+        return kernel
 
-    def execute(self, code):
-        """ Execute **code** """
+    async def start_watch(self, kernel, timeout):
+        """ Start **kernel**. Forget it if it fails or takes more than
+        **timeout** s. """
 
-        value = None
-        MSG_RECEIVED = False
+        try:
+            await asyncio.wait_for(kernel.start(), timeout)
+        except Exception:
+            logger.error('Cannot watch kernel {}'.format(kernel.kid), exc_info=True)
+            del self.kernels[kernel.cf]
+            kernel.stop()
+            # Wake up the clients waiting for this kernel
+            kernel.started.set()
+
+    async def serve_main(self, reader, writer):
+        """ Client connected to main socket. Send it the namespace of the current
+        kernel, then change its subscription when it asks for. """
+
+        client = Client(reader, writer)
+        logger.info("{} connected to main socket".format(client.address))
+        self.main_clients.append(client)
+
+        # The namespace is sent without waiting for the hello : frames are
+        # compressed from the welcome on
+        subscribed = spawn(self.subscribe(client, self.cf), client.tasks)
 
-        msg_id = self.kc.execute(code, store_history=False)
-        logger.debug("EXEC : '{}' sent with id {}".format(code, msg_id.split('-')[0]))
+        try:
+            while True:
+                msg = await read_frame(reader)
+                if msg is None:
+                    break
+                try:
+                    request = json.loads(decode(*msg, client.codec).decode('utf8'))
+                except ValueError:
+                    continue
+                if not isinstance(request, dict):
+                    continue
+                if request.get('type') == 'hello':
+                    self.welcome(client, request)
+                elif request.get('type') == 'subscribe':
+                    await asyncio.wait([subscribed])
+                    await self.subscribe(client, request.get('cf'))
+        except ConnectionError:
+            pass
 
-        while not MSG_RECEIVED:
-            self.wait_msg()
+        self.drop(client)
 
-            while self.kc.iopub_channel.msg_ready():
-                data = self.kc.get_iopub_msg()
-                if data['parent_header']['msg_id'] != msg_id:
-                    logger.debug('EXEC : PASS MSG : {}'.format(self.disp_data(data)))
-                    self.check_init(data)
-                    continue
-                else:
-                    MSG_RECEIVED = True
-                    logger.debug('EXEC : PROCEED MSG : {}'.format(self.disp_data(data)))
-                    if data['header']['msg_type'] == 'stream':
-                        value = data['content']['text']
+    async def hello(self, client):
+        """ Read the first frame of **client** and negotiate compression if it
+        is a hello message. Return this frame if it is another message. """
+
+        msg = await read_frame(client.reader)
+        if msg is None:
+            return None
+
+        try:
+            hello = json.loads(msg[1].decode('utf8'))
+        except ValueError:
+            return msg
+        if not isinstance(hello, dict) or hello.get('type') != 'hello':
+            return msg
 
-        logger.debug('EXEC : RESULT :\n {}'.format(value))
-        self.msg = 0
+        self.welcome(client, hello)
 
-        return value
+        return None
 
-    def wait_msg(self):
-        """ Waiting for message from iopub channel """
+    def welcome(self, client, hello):
+        """ Answer the **hello** message of **client** with the codec chosen
+        for its connection """
 
-        while not self.kc.iopub_channel.msg_ready():  # To fix.Have to wait
-            sleep(self.delay)
+        client.push(frame(client.negotiate(hello, self.threshold)))
+        logger.info('{} uses codec {}'.format(client.address, client.codec))
 
-    def listen_main_sock(self):
-        """ Look for client connection to main socket. """
+    async def subscribe(self, client, cf):
+        """ Send the namespace of kernel **cf** to main **client**. It keeps
+        its subscription if **cf** cannot be watched. """
 
         try:
-            self.client_main, address = self.MainSock.accept()
-            logger.info("{} connected to main socket".format(address))
-        except BlockingIOError:
-            pass
-        else:
-            send_msg(self.client_main, self.variables)
+            kernel = await self.watch(cf)
+        except ConnectionError as err:
+            logger.error('{} cannot subscribe to {} : {}'.format(client.address, cf, err))
+            return
 
-    def listen_request_sock(self):
-        """ Look for client connection to request socket. """
+        if client.kernel:
+            client.kernel.subscribers.remove(client)
+        client.kernel = kernel
+        kernel.subscribe(client)
+        logger.info("{} subscribed to kernel {}".format(client.address, kernel.kid))
+
+    async def serve_requests(self, reader, writer):
+        """ Client connected to request socket. Handle its requests. """
+
+        client = Client(reader, writer)
+        client.selected = spawn(self.select(self.cf), client.tasks)
+        logger.info("{} connected to request socket".format(client.address))
+        self.request_clients.append(client)
 
         try:
-            self.client_request, address = self.RequestSock.accept()
-            logger.info("{} connected to request socket".format(address))
-        except BlockingIOError:
+            pending = await self.hello(client)
+            while True:
+                msg = pending or await read_frame(reader)
+                pending = None
+                if msg is None:
+                    break
+                request = self.parse_request(client, msg)
+                if request is None:
+                    continue
+                log = logger.debug if request['type'] == 'ping' else logger.info
+                log('Request {id} from client : {type}'.format(**request))
+                logger.debug('RECEIVED :\n {}'.format(request))
+                # Requests received after a kernel change apply to the new kernel
+                if request['type'] == 'kernel':
+                    client.selected = spawn(self.select(request.get('cf'), client.selected),
+                                            client.tasks)
+                spawn(self.handle_request(client, request, client.selected), client.tasks)
+        except ConnectionError:
             pass
 
-    def check_variables(self):
-        """ If variables is None, ask again to kernel """
-        if not self.variables:
-            logger.debug("EXEC : 'variables' is None : RUN AGAIN 'whos'")
-        while not self.variables:
-            self.variables = self.execute('whos')
+        self.drop(client)
 
-    def kernel_change(self, cf):
-        """ Watch kernel changes """
+    def parse_request(self, client, msg):
+        """ Request of **client** read from frame **msg**. None if it is
+        malformed : it is then answered with an error if it has an id. """
 
-        old_id = set_kid(self.kc.connection_file)
-        _, self.kc = connect_kernel(cf)
-        new_id = set_kid(self.kc.connection_file)
+        try:
+            request = json.loads(decode(*msg, client.codec).decode('utf8'))
+        except (ValueError, KeyError, TypeError):
+            logger.error('Unreadable request from {}'.format(client.address))
+            return None
 
-        # Update kd5.lock files
-        self.update_lockfile(new_id)
-        logger.info('Kernel change from {} to {}'.format(old_id, new_id))
+        if isinstance(request, dict) and isinstance(request.get('id'), int) \
+                and isinstance(request.get('type'), str):
+            return request
+
+        logger.error('Malformed request from {} : {}'.format(client.address, request))
+        if isinstance(request, dict) and 'id' in request:
+            self.reply(client, request, status='error', error='Malformed request')
+
+        return None
+
+    def drop(self, client):
+        """ Forget a client """
+
+        logger.info("{} is disconnected !".format(client.address))
+        client.close()
+        if client in self.main_clients:
+            self.main_clients.remove(client)
+            # Gone before its first subscription was done
+            if client.kernel:
+                client.kernel.subscribers.remove(client)
+        elif client in self.request_clients:
+            self.request_clients.remove(client)
+
+    async def select(self, cf, previous=None):
+        """ Kernel the requests of a client apply to once it asked for kernel
+        **cf**. Kernel changes are done in the order they are asked : if **cf**
+        cannot be watched, the kernel **previous** resolves to is kept (None
+        if there is none). """
+
+        kernel = await previous if previous else None
+        try:
+            return await self.watch(cf)
+        except ConnectionError as err:
+            logger.error('Kernel change to {} failed : {}'.format(cf, err))
+            return kernel
+
+    def kernel_change(self, kernel):
+        """ The daemon now watches **kernel** for new clients """
 
-        # Force kernel update
-        self.send_variables()
+        old_id = set_kid(self.cf)
+        self.cf = kernel.cf
+        metrics.inc('kernel_switches')
+
+        # Update kd5.lock files
+        self.update_lockfile(kernel.kid)
+        logger.info('Kernel change from {} to {}'.format(old_id, kernel.kid))
 
     def update_lockfile(self, new_id):
         """ Update lock files """
@@ -305,74 +1180,190 @@ class Watcher(threading.Thread):
         with open(LogDir + 'kd5.lock', 'w') as f:
             f.write(new_id)
 
-    def send_variables(self):
-        """ Send variable to client """
+    async def handle_request(self, client, request, selected):
+        """ Handle kernel changes | new kernel | exec code | eval | delete |
+        array | stop | resync | ping | stats. Requests to a kernel apply to
+        the kernel **selected** resolves to. The reply is sent once the
+        request is done. """
+
+        rtype = request['type']
+        start = monotonic()
+        metrics.inc('requests', type=rtype)
+
+        try:
+            if rtype not in ('new', 'stop', 'ping', 'stats'):
+                kernel = await selected
+                if kernel is None:
+                    raise ConnectionError('No kernel watched')
+
+            if rtype == 'kernel':
+                if kernel.cf != request['cf']:
+                    raise ConnectionError('Cannot watch kernel {}'.format(request['cf']))
+                self.kernel_change(kernel)
+                self.reply(client, request)
+
+            elif rtype == 'new':
+                self.reply(client, request, kid=await self.pool.take())
+
+            elif rtype == 'stop':
+                self.reply(client, request)
+                self.stop()
+
+            elif rtype == 'ping':
+                self.reply(client, request)
+                self.report_latencies(request.get('latencies', []))
+
+            elif rtype == 'stats':
+                self.reply(client, request, stats=self.stats())
+
+            elif rtype == 'resync':
+                # Request and main sockets are not paired : resync all subscribers
+                kernel.broadcast(kernel.snapshot.full())
+                self.reply(client, request)
+
+            elif rtype in ('code', 'delete'):
+                if rtype == 'delete':
+                    request['code'] = 'del {}'.format(request['name'])
+                content = await kernel.execute(request['code'])
+                if content['status'] == 'ok':
+                    self.reply(client, request)
+                else:
+                    self.reply(client, request, status=content['status'],
+                               error=content.get('ename'))
+                # Silent executions are not broadcast on iopub
+                kernel.check_reset(request['code'])
+                kernel.schedule_refresh()
+
+            elif rtype == 'eval':
+                content = await kernel.execute('', {'value': request['expr']})
+                value = kernel.expression(content, 'value')
+                if value is None:
+                    self.reply(client, request, status='error',
+                               error=content['user_expressions'].get('value', {}).get('ename'))
+                else:
+                    self.reply(client, request, value=value)
+
+            elif rtype == 'array' and request.get('shm'):
+                await self.share_array(client, kernel, request)
+
+            elif rtype == 'array':
+                await self.send_array(client, kernel, request)
+
+            elif rtype == 'release':
+                header, conn = await kernel.ask_agent('release {}'.format(request['shm']))
+                if conn:
+                    conn[1].close()
+                self.reply(client, request, **header)
 
-        self.variables = self.execute('whos')
-        self.check_variables()
-        # Send to client
-        if self.client_main:
-            try:
-                send_msg(self.client_main, self.variables)
-            except BlockingIOError:
-                logger.info("Client is disconnected from main socket!")
-                self.client_main = None
             else:
-                logger.info('Variable list sent to client')
+                self.reply(client, request, status='error', error='Unknown request')
 
-    @staticmethod
-    def disp_id(data):
-        """ Display first seq of message id only """
-        return data['parent_header']['msg_id'].split('-')[0]
-
-    @classmethod
-    def disp_data(cls, data):
-        if data['msg_type'] == 'status':
-            dbg = '{} | status : {}'.format(cls.disp_id(data), data['content']['execution_state'])
-        elif data['msg_type'] == 'execute_input':
-            dbg = '{} | code : {}'.format(cls.disp_id(data), data['content']['code'])
-        elif data['msg_type'] == 'stream':
-            dbg = '{} | stream'.format(cls.disp_id(data))
-        elif data['msg_type'] == 'error':
-            dbg = '{} | error : {}'.format(cls.disp_id(data), data['content']['ename'])
-        else:
-            dbg = '{} {}'.format(cls.disp_id(data), data['msg_type'])
-        return dbg
+        except ConnectionError as err:
+            self.reply(client, request, status='error', error=str(err))
 
-    def fetch_request(self):
-        """ Listen to sock request :
-            handle kernel changes | exec code | stop signal. """
+        except (KeyError, ValueError, TypeError) as err:
+            logger.error('Malformed request {}'.format(request['id']), exc_info=True)
+            self.reply(client, request, status='error',
+                       error='Malformed request : {!r}'.format(err))
 
-        try:
-            tmp = recv_msg(self.client_request).decode('utf8')
-        except AttributeError:
-            tmp = None
-            self.client_request = None
-            logger.info("Client is disconnected from request socket!")
-
-        if tmp:
-            self._pause.set()
-            sleep(self.delay)
-            logger.info('Request from client')
-            logger.debug('RECEIVED :\n {}'.format(tmp))
-
-            if '<cf>' in tmp:
-                cf = tmp.split('<cf>')[1]
-                self.kernel_queue.put(cf)           # Send new k to streamer
-
-            elif '<_stop>' in tmp:
-                self.stop()
+        metrics.observe('request_seconds', monotonic() - start, type=rtype)
+
+    async def send_array(self, client, kernel, request):
+        """ Answer with dtype/shape/nbytes of the array then relay its buffer
+        from the agent of **kernel** to **client**, chunk by chunk. """
 
-            elif '<code>' in tmp:
-                self.execute(tmp.split('<code>')[1])
+        header, conn = await kernel.ask_agent('array {}'.format(request['name']))
+        if not conn:
+            self.reply(client, request, status='error', error=header['error'])
+            return
 
-            self._pause.clear()
+        self.reply(client, request, **header)
+        logger.info('Sending array {} ({} bytes)'.format(request['name'], header['nbytes']))
+
+        reader, writer = conn
+        remaining = header['nbytes']
+        try:
+            while remaining:
+                data = await reader.read(min(CHUNK, remaining))
+                if not data:
+                    logger.error('Array transfer {} interrupted'.format(request['id']))
+                    self.reply(client, request, status='error', error='Transfer interrupted')
+                    return
+                remaining -= len(data)
+                client.push(binary_header(request['id'], len(data)))
+                client.push(data)
+                # Do not read faster than the client
+                await client.drained.wait()
+        finally:
+            writer.close()
+
+    async def share_array(self, client, kernel, request):
+        """ Answer with the shared memory segment of **kernel** holding the
+        array """
+
+        header, conn = await kernel.ask_agent('share {}'.format(request['name']))
+        if not conn:
+            self.reply(client, request, status='error', error=header['error'])
+            return
+
+        conn[1].close()
+        logger.info('Array {} shared in {}'.format(request['name'], header['shm']))
+        self.reply(client, request, **header)
+
+    def reply(self, client, request, status='ok', **kwargs):
+        """ Answer **request** of **client** """
+
+        if client not in self.request_clients:
+            return
+
+        kwargs.update(id=request['id'], status=status)
+        client.push(client.encode(json.dumps(kwargs)))
+
+    def stats(self):
+        """ Dump of the metrics, with the current state of clients and kernels """
+
+        metrics.gauges.clear()
+        metrics.set('kernels_watched', len(self.kernels))
+        metrics.set('spare_kernels', len(self.pool.kernels))
+        metrics.set('clients', len(self.main_clients), socket='main')
+        metrics.set('clients', len(self.request_clients), socket='request')
+        metrics.set('requests_in_flight', sum(len(c.tasks) for c in self.request_clients))
+        for client in self.main_clients + self.request_clients:
+            metrics.set('queued_bytes', client.queued, client=client.id)
+
+        return metrics.dump()
+
+    def report_latencies(self, latencies):
+        """ Store the end-to-end latencies reported by a client. Log their
+        percentiles every LATENCY_INTERVAL s. """
+
+        for latency in latencies:
+            self.latencies.append(latency)
+            metrics.observe('freshness_seconds', latency)
+
+        if latencies and monotonic() - self.latency_logged > LATENCY_INTERVAL:
+            self.latency_logged = monotonic()
+            ms = ['{:.1f}'.format(1e3*percentile(self.latencies, q)) for q in (0.5, 0.95, 0.99)]
+            logger.info('End-to-end latency over {} updates : p50 {} ms, p95 {} ms, p99 {} ms'.format(
+                len(self.latencies), *ms))
+
+    async def write_metrics(self):
+        """ Write the metrics in the Prometheus text format periodically """
+
+        while True:
+            try:
+                write_prometheus(self.stats(), self.metrics_file)
+            except OSError:
+                logger.error('Cannot write metrics', exc_info=True)
+            await asyncio.sleep(METRICS_INTERVAL)
 
     def stop(self):
-        """ Stop thread. """
+        """ Stop the event loop. """
 
-        logger.info("Client sent SIGTERM")
-        self._stop.set()
+        # kd5 stop sends SIGTERM until the daemon is gone
+        if not self.stopped.is_set():
+            logger.info("Client sent SIGTERM")
+            self.stopped.set()
 
 
 class Daemonize(Daemon):
@@ -393,18 +1384,31 @@ class Daemonize(Daemon):
         self.cf = WatcherArgs['cf']
         self.sport = WatcherArgs['sport']
         self.rport = WatcherArgs['rport']
-        self.delay = WatcherArgs['delay']
+        self.busy_refresh = WatcherArgs['busy-refresh']
+        self.debounce = WatcherArgs['debounce']
+        self.kernels = WatcherArgs['kernels']
+        self.transport = WatcherArgs['transport']
+        self.threshold = WatcherArgs['compression-threshold']
+        self.metrics_file = WatcherArgs['metrics-file']
+        self.pool = WatcherArgs['pool']
+        self.version = WatcherArgs['version']
 
     def run(self):
         """ Override Daemon run method with this method. """
 
-        km, kc = connect_kernel(self.cf)
-        WK = Watcher(kc,
+        WK = Watcher(self.cf,
                      sport=self.sport,
                      rport=self.rport,
-                     delay=self.delay)
-        WK.start()
-        WK.join()
+                     busy_refresh=self.busy_refresh,
+                     debounce=self.debounce,
+                     kernels=self.kernels,
+                     transport=self.transport,
+                     threshold=self.threshold,
+                     metrics_file=self.metrics_file,
+                     pool=self.pool,
+                     version=self.version,
+                     ready=self.ready)
+        asyncio.run(WK.run())
 
 
 def parse_args(lockfile, pidfile, Config):
@@ -412,7 +1416,7 @@ def parse_args(lockfile, pidfile, Config):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('action', choices=('start', 'stop', 'restart',
-                                           'last', 'status', 'list'))
+                                           'last', 'status', 'list', 'stats'))
     parser.add_argument("integer",
                         help="Start up with existing kernel. \
                         INTEGER is the id of the connection file.",
@@ -446,20 +1450,57 @@ def parse_args(lockfile, pidfile, Config):
         status_action(pidfile, lockfile)
         sys.exit(0)
 
+    # Stats action
+    elif args.action == 'stats':
+        stats_action(Config)
+        sys.exit(0)
+
     return args, kid
 
 
 def create_new(Config):
-    """ Create new kernel """
+    """ Create new kernel, or take a spare kernel of the last daemon """
+
+    kid = spare_kernel()
+    if kid:
+        sys.stdout.write('Spare kernel id {} taken\n'.format(kid))
+        return kid
 
     sys.stdout.write('Creating new kernel...\n')
-    kid = start_new_kernel(version=Config['kernel version']['version'])
-    message = 'Kernel id {} created (Python {})\n'
-    sys.stdout.write(message.format(kid, Config['kernel version']['version']))
+    start = monotonic()
+    try:
+        kid = start_new_kernel(version=Config['kernel version']['version'])
+    except RuntimeError as err:
+        sys.stderr.write('{}Error :\t{}{} !\n\tExiting\n'.format(RED, RESET, err))
+        sys.exit(1)
+
+    message = 'Kernel id {} created (Python {}) in {:.2f} s\n'
+    sys.stdout.write(message.format(kid, Config['kernel version']['version'], monotonic() - start))
+    logger.info('Startup :: kernel {} ready in {:.3f} s'.format(kid, monotonic() - start))
 
     return kid
 
 
+def spare_kernel(poolfile=POOL_FILE):
+    """ Take a live kernel from the pool file. None if there is none. """
+
+    kids = read_pool(poolfile)
+    while kids:
+        kid = kids.pop(0)
+        try:
+            alive = is_runing(find_connection_file(kid))
+        except OSError:
+            continue
+        if alive:
+            write_pool(poolfile, kids)
+            return kid
+
+    if os.path.exists(poolfile):
+        write_pool(poolfile, kids)
+
+    return None
+
+
 def start_action(args, lockfile, Config):
     """ Start Parser action. """
 
@@ -531,6 +1572,22 @@ def status_action(pidfile, lockfile):
     status_lock(lockfile)
 
 
+def stats_action(Config):
+    """ Print the metrics of the running daemon """
+
+    try:
+        sock = connect(Config['comm']['transport'], int(Config['comm']['r-port']))
+        sock.settimeout(TIMEOUT)
+        send_msg(sock, json.dumps({'id': 1, 'type': 'stats'}))
+        reply = json.loads(recv_msg(sock).decode('utf8'))
+        sock.close()
+    except (OSError, AttributeError):
+        sys.stderr.write('{}Error :\t{}Cannot reach kd5 !\n'.format(RED, RESET))
+        sys.exit(1)
+
+    sys.stdout.write(report(reply['stats']))
+
+
 def status_pid(pidfile):
     """ Status of the daemon """
 
@@ -599,7 +1656,14 @@ def main(args=None):
 
     sport = int(Config['comm']['s-port'])
     rport = int(Config['comm']['r-port'])
-    delay = float(Config['daemon']['refresh'])
+    busy_refresh = float(Config['daemon']['busy-refresh'])
+    debounce = float(Config['daemon']['debounce'])
+    kernels = Config['daemon']['kernels']
+    transport = Config['comm']['transport']
+    threshold = int(Config['comm']['compression-threshold'])
+    metrics_file = os.path.expanduser(Config['daemon']['metrics-file']) or None
+    pool = int(Config['daemon']['pool'])
+    version = Config['kernel version']['version']
 
     try:
         cfile = find_connection_file(kid)
@@ -610,9 +1674,16 @@ def main(args=None):
         kdwrite(lockfile, kid)
 
     WatchConf = {'cf': cfile,
-                 'delay': delay,
                  'sport': sport,
-                 'rport': rport}
+                 'rport': rport,
+                 'busy-refresh': busy_refresh,
+                 'debounce': debounce,
+                 'kernels': kernels,
+                 'transport': transport,
+                 'compression-threshold': threshold,
+                 'metrics-file': metrics_file,
+                 'pool': pool,
+                 'version': version}
 
     daemon = Daemonize(pidfile, WatchConf, stdout=logfile, stderr=logfile)
 
@@ -39,7 +39,6 @@ from cpyvke.curseswin.prompt import Prompt
 from cpyvke.curseswin.app import check_size
 from cpyvke.utils.kd import restart_daemon
 from cpyvke.utils.display import format_cell
-from cpyvke.utils.comm import send_msg
 
 code = locale.getpreferredencoding()
 
@@ -321,7 +320,7 @@ class BasePanel(abc.ABC):
             self.prompt_msg_setup(err)
         elif code:
             try:
-                send_msg(self.sock.RequestSock, '<code>' + code)
+                self.sock.request('code', wait_reply=False, code=code)
                 self.logger.info('Code sent to kernel : {}'.format(code))
                 self.prompt_msg_setup('Code sent !')
             except Exception:
@@ -0,0 +1,381 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 11:02:17 CEST
+# Last Modified : dim. 18 oct. 2026 11:02:17 CEST
+"""
+-----------
+DOCSTRING
+
+Kernel side agent. Imported in the kernel as _agent by init_kernel().
+
+snapshot() describes each variable of the user namespace with a small record :
+
+    {'type': 'ndarray', 'value': preview, 'shape': [50, 50],
+     'dtype': 'float64', 'len': 50, 'nbytes': 20000}
+
+Only 'type' and 'value' are always present. The records come with the
+execution count of the kernel, the time the last cell ended and the time of the
+scan (time.monotonic, the same clock for all processes of the host). Records
+are cached between scans and only rebuilt for variables whose fingerprint
+changed.
+
+serve() answers snapshot requests from a background thread : kd5 can read the
+namespace while a cell is running, without queueing behind it on the shell
+channel.
+
+'array <name>' requests are answered by a json header {'dtype', 'shape',
+'nbytes'} followed by the raw buffer of the array, sent as is.
+'share <name>' publishes the array in shared memory instead (see shared.py)
+and 'release <segment>' unlinks it.
+
+@author: Cyril Desjouy
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import atexit
+import threading
+from itertools import islice
+from cpyvke.utils.comm import send_msg, recv_msg
+from cpyvke.utils import shared
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+
+# Variables created by cpyvke itself
+SKIP = ('fcpyvke0',)
+
+# Unix socket served by the agent thread
+SERVER = None
+
+# Bounded preview of the values
+PREVIEW = reprlib.Repr()
+PREVIEW.maxstring = 120
+PREVIEW.maxother = 120
+
+# Records of the last scan : {id(value): (fingerprint, record)}
+CACHE = {}
+
+# Items of a container looked at by its fingerprint (the preview shows less)
+SAMPLES = 8
+
+# Immutable types whose value is their key
+SCALARS = (int, float, complex, bool, str, bytes, type(None))
+
+# Containers rendered item by item by reprlib
+CONTAINERS = (list, tuple, dict, set, frozenset)
+
+# Time the last cell ended (time.monotonic)
+EXECUTED = None
+
+
+def is_array(obj):
+    """ True if obj is an array of at least one dimension """
+
+    ndim = getattr(obj, 'ndim', None)
+
+    return isinstance(ndim, int) and ndim > 0 and hasattr(obj, 'dtype')
+
+
+def preview(obj):
+    """ Short representation of obj. Never renders a whole container.
+    Arrays are described by their shape and dtype only. """
+
+    if type(obj).__name__ == 'module':
+        return obj.__name__
+
+    if is_array(obj):
+        return ''
+
+    # numpy scalars and 0-d arrays are shown as their value, as whos did
+    if hasattr(obj, 'dtype') and hasattr(obj, 'item'):
+        try:
+            return PREVIEW.repr(obj.item())
+        except Exception:
+            pass
+
+    return PREVIEW.repr(obj)
+
+
+def summary(obj):
+    """ Record describing obj """
+
+    record = {'type': type(obj).__name__}
+
+    try:
+        record['value'] = preview(obj)
+
+        shape = getattr(obj, 'shape', None)
+        if isinstance(shape, tuple):
+            record['shape'] = [int(i) for i in shape]
+            if hasattr(obj, 'dtype'):
+                record['dtype'] = str(obj.dtype)
+
+        if not isinstance(obj, type):
+            try:
+                record['len'] = len(obj)
+            except TypeError:
+                pass
+
+        nbytes = getattr(obj, 'nbytes', None)
+        if isinstance(nbytes, int):
+            record['nbytes'] = nbytes
+        else:
+            record['nbytes'] = sys.getsizeof(obj)
+
+    except Exception:
+        record['value'] = '<unavailable>'
+
+    return record
+
+
+def sample(obj):
+    """ Items of a dict or set the preview may show : the smallest ones, like
+    reprlib, or the first ones if they cannot be compared """
+
+    try:
+        return heapq.nsmallest(SAMPLES, obj)
+    except TypeError:
+        return list(islice(obj, SAMPLES))
+
+
+def content_key(obj, level):
+    """ Key of what the preview of obj shows when it is rendered at **level**
+    (see reprlib). None if there is no cheap key. """
+
+    kind = type(obj)
+
+    if kind in CONTAINERS:
+        if level <= 0:
+            # Rendered as [...]
+            return kind, len(obj)
+
+        if kind is dict:
+            items = [i for key in sample(obj) for i in (key, obj[key])]
+        elif kind in (set, frozenset):
+            items = sample(obj)
+        else:
+            items = list(islice(obj, SAMPLES))
+
+        items = [content_key(i, level - 1) for i in items]
+        if None in items:
+            return None
+
+        return kind, len(obj), sys.getsizeof(obj), tuple(items)
+
+    if kind in (float, complex):
+        # 0.0 == -0.0 : compare what is shown
+        return kind, repr(obj)
+
+    if kind in SCALARS:
+        return kind, obj
+
+    return None
+
+
+def fingerprint(obj):
+    """ Cheap key which changes when the record of obj may change.
+    None if obj must be summarized at each scan. """
+
+    # Records of arrays only show their shape, dtype and size (see preview)
+    shape = getattr(obj, 'shape', None)
+    if isinstance(shape, tuple) and is_array(obj):
+        iface = getattr(obj, '__array_interface__', None)
+        data = iface['data'][0] if isinstance(iface, dict) else None
+        return type(obj), shape, str(obj.dtype), data
+
+    return content_key(obj, PREVIEW.maxlevel)
+
+
+def cached_summary(obj, cache):
+    """ Record of obj, reused from the previous scan if its fingerprint did
+    not change. The record is stored in **cache** for the next scan. """
+
+    try:
+        key = fingerprint(obj)
+    except Exception:
+        key = None
+
+    previous = CACHE.get(id(obj))
+    if key is not None and previous and previous[0] == key:
+        record = previous[1]
+    else:
+        record = summary(obj)
+
+    if key is not None:
+        cache[id(obj)] = (key, record)
+
+    return record
+
+
+def user_variables():
+    """ (name, value) pairs of the interactive namespace, as listed by whos """
+
+    from IPython import get_ipython
+
+    ip = get_ipython()
+    hidden = ip.user_ns_hidden
+
+    return [(name, value) for name, value in list(ip.user_ns.items())
+            if not name.startswith('_') and name not in hidden and name not in SKIP]
+
+
+def snapshot():
+    """ Json encoded records of the whole namespace :
+    {'variables': records, 'execution_count': n, 'executed': time, 'captured': time} """
+
+    from IPython import get_ipython
+
+    global CACHE
+
+    cache = {}
+    records = {name: cached_summary(value, cache) for name, value in user_variables()}
+    # Only variables still alive are kept
+    CACHE = cache
+
+    return json.dumps({'variables': records,
+                       'execution_count': get_ipython().execution_count,
+                       'executed': EXECUTED,
+                       'captured': time.monotonic()})
+
+
+def executed(*args):
+    """ post_run_cell hook : note when the cell ended """
+
+    global EXECUTED
+
+    EXECUTED = time.monotonic()
+
+
+def serve(path):
+    """ Serve snapshot requests on unix socket **path** from a background thread.
+    Nothing is done if the agent is already serving. """
+
+    global SERVER
+
+    if SERVER:
+        return
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    SERVER = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    SERVER.bind(path)
+    os.chmod(path, 0o600)
+    SERVER.listen(5)
+    atexit.register(os.remove, path)
+
+    from IPython import get_ipython
+    get_ipython().events.register('post_run_cell', executed)
+
+    thread = threading.Thread(target=accept_loop, name='cpyvke-agent')
+    thread.daemon = True
+    thread.start()
+
+
+def accept_loop():
+    """ Accept kd5 connections """
+
+    while True:
+        conn, _ = SERVER.accept()
+        thread = threading.Thread(target=answer_loop, args=(conn,), name='cpyvke-agent-client')
+        thread.daemon = True
+        thread.start()
+
+
+def answer_loop(conn):
+    """ Answer requests of one connection until it is closed """
+
+    while True:
+        try:
+            request = recv_msg(conn)
+        except OSError:
+            request = None
+
+        if request is None:
+            conn.close()
+            return
+
+        if request == b'snapshot':
+            send_msg(conn, snapshot())
+
+        elif request.startswith(b'array '):
+            send_array(conn, request[6:].decode('utf8'))
+
+        elif request.startswith(b'share '):
+            share_array(conn, request[6:].decode('utf8'))
+
+        elif request.startswith(b'release '):
+            shared.release(request[8:].decode('utf8'))
+            send_msg(conn, json.dumps({}))
+
+
+def array(name):
+    """ Contiguous array **name** of the namespace. Raise TypeError if it
+    cannot be sent as a raw buffer. """
+
+    from IPython import get_ipython
+    import numpy
+
+    obj = get_ipython().user_ns.get(name)
+    if not hasattr(obj, '__array__') or not hasattr(obj, 'dtype'):
+        raise TypeError('{} is not an array'.format(name))
+
+    if obj.dtype.hasobject or obj.dtype.fields:
+        raise TypeError('dtype {} cannot be sent'.format(obj.dtype))
+
+    return numpy.ascontiguousarray(obj)
+
+
+def send_array(conn, name):
+    """ Send the header then the buffer of the array **name** """
+
+    import numpy
+
+    try:
+        data = array(name)
+    except TypeError as err:
+        send_msg(conn, json.dumps({'error': str(err)}))
+        return
+
+    send_msg(conn, json.dumps({'dtype': data.dtype.str,
+                               'shape': list(data.shape),
+                               'nbytes': data.nbytes}))
+    if data.nbytes:
+        conn.sendall(data.reshape(-1).view(numpy.uint8))
+
+
+def share_array(conn, name):
+    """ Publish the array **name** in shared memory and send its header """
+
+    try:
+        header = shared.publish(array(name))
+    except (TypeError, OSError) as err:
+        header = {'error': str(err)}
+
+    send_msg(conn, json.dumps(header))
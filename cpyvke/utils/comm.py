@@ -29,31 +29,289 @@ DOCSTRING
 """
 
 
+import os
+import json
+import zlib
+import select
+import socket
 import struct
 
 
+# Frame header : payload length and flags
+HEADER = struct.Struct('>IB')
+
+# Payload is raw data (array chunk) prefixed by the request id
+FLAG_BINARY = 1
+RID = struct.Struct('>I')
+
+# Payload is compressed with the codec negotiated for the connection
+FLAG_COMPRESSED = 2
+
+# Codecs known here : {name: (compress, decompress)}
+CODECS = {'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress)}
+
+try:
+    import lz4.frame
+    CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+# Smaller payloads are not worth compressing (see tests/bench_compression.py)
+THRESHOLD = 8192
+
+# Max time to wait for the end of a frame already started
+TIMEOUT = 10
+
+# Start of the welcome frame answering a hello (never compressed)
+WELCOME = b'{"type": "welcome"'
+
+# Directory of the unix sockets of kd5
+SOCKET_DIR = os.path.expanduser('~') + '/.cpyvke/'
+
+
+def unix_transport(transport):
+    """ Use unix sockets for **transport** ('unix' or 'tcp') if available """
+    return transport == 'unix' and hasattr(socket, 'AF_UNIX')
+
+
+def unix_path(port):
+    """ Path of the unix socket standing for tcp **port** """
+    return SOCKET_DIR + 'kd5-{}.sock'.format(port)
+
+
+def connect(transport, port):
+    """ Socket connected to kd5 by **transport** ('unix' or 'tcp') """
+    if unix_transport(transport):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(unix_path(port))
+    else:
+        sock = socket.create_connection(('localhost', port))
+    return sock
+
+
+def register_codec(name, compress, decompress):
+    """ Make codec **name** available for negotiation """
+    CODECS[name] = (compress, decompress)
+
+
+def frame(msg, flags=0, codec=None, threshold=THRESHOLD):
+    """ Prefix message with its length (network byte order) and flags.
+    Compress it with **codec** if it is larger than **threshold** bytes.
+    Build a frame once to send it to several clients. """
+    if isinstance(msg, str):
+        msg = msg.encode('utf8')
+    if codec and len(msg) >= threshold:
+        msg = CODECS[codec][0](msg)
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(len(msg), flags) + msg
+
+
+def decode(flags, data, codec=None):
+    """ Payload of a frame, decompressed if needed """
+    if flags & FLAG_COMPRESSED:
+        return CODECS[codec][1](data)
+    return data
+
+
+def binary_header(rid, size):
+    """ Header of a binary frame carrying **size** bytes for request **rid**.
+    Sent before the data itself to avoid copying it. """
+    return HEADER.pack(size + RID.size, FLAG_BINARY) + RID.pack(rid)
+
+
 def send_msg(sock, msg):
-    """ Prefix each message with a 4-byte length (network byte order) """
-    msg = struct.pack('>I', len(msg)) + msg.encode('utf8')
-    sock.sendall(msg)
+    """ Send a framed message """
+    sock.sendall(frame(msg))
 
 
-def recv_msg(sock):
+def recv_header(sock):
+    """ (length, flags) of the next frame or None if EOF is hit.
+    Raise BlockingIOError if nothing is available on a non-blocking socket. """
+    raw = bytearray(HEADER.size)
+    n = sock.recv_into(raw)
+    if not n:
+        return None
+    if not recv_into_all(sock, memoryview(raw)[n:]):
+        return None
+    return HEADER.unpack(raw)
+
+
+def recv_msg(sock, codec=None):
     """ Read message length and unpack it into an integer """
-    raw_msglen = recv_all(sock, 4)
-    if not raw_msglen:
+    header = recv_header(sock)
+    if not header:
         return None
-    msglen = struct.unpack('>I', raw_msglen)[0]
     # Read the message data
-    return recv_all(sock, msglen)
+    data = recv_all(sock, header[0])
+    if data is None:
+        return None
+    return decode(header[1], data, codec)
+
+
+def offer(sock, codecs):
+    """ Offer **codecs** to kd5 without waiting for its welcome, which
+    starts with WELCOME """
+    send_msg(sock, json.dumps({'type': 'hello', 'codecs': codecs}))
+
+
+def hello(sock, codecs):
+    """ Offer **codecs** to kd5 on a new connection (blocking socket).
+    Return the codec kd5 chose or None. """
+    sock.settimeout(TIMEOUT)
+    try:
+        offer(sock, codecs)
+        welcome = json.loads(recv_msg(sock).decode('utf8'))
+    finally:
+        sock.settimeout(None)
+    return welcome.get('codec')
+
+
+def codecs(compression):
+    """ Known codecs of the comma separated list **compression** ('none' for
+    no compression) """
+    names = [c.strip() for c in compression.split(',')]
+    return [c for c in names if c in CODECS]
 
 
 def recv_all(sock, n):
     """ Helper function to recv n bytes or return None if EOF is hit """
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
+    data = bytearray(n)
+    if not recv_into_all(sock, memoryview(data)):
+        return None
     return data
+
+
+def recv_into_all(sock, view):
+    """ Fill **view** from sock. Return False if EOF is hit.
+    Non-blocking sockets are waited for : the frame is already started. """
+    while len(view):
+        try:
+            n = sock.recv_into(view)
+        except BlockingIOError:
+            if not select.select([sock], [], [], TIMEOUT)[0]:
+                raise TimeoutError('Frame incomplete')
+            continue
+        if not n:
+            return False
+        view = view[n:]
+    return True
+
+
+class FrameDecoder:
+    """ Frames of a non-blocking socket, decoded as the data comes.
+
+    read() receives what is available and yields the frames as they are
+    completed. A frame may come in any number of pieces. Small frames are
+    parsed from a fixed buffer. Larger payloads are received in place in a
+    buffer of their own size, allocated once. Binary frames are received
+    where **into**(rid, size) says and yielded as (flags, rid) once complete.
+    Each frame is yielded before the next one is parsed : a reply can prepare
+    where the binary frames that follow it go.
+    """
+
+    # Size of the receive buffer
+    BUFSIZE = 1 << 16
+
+    def __init__(self, sock, codec=None, into=None):
+
+        self.sock = sock
+        self.codec = codec
+        self.into = into
+        self.buffer = bytearray(self.BUFSIZE)
+        self.view = memoryview(self.buffer)
+        # Received data not parsed yet : buffer[start:end]
+        self.start = 0
+        self.end = 0
+        # Frame being received in place : flags, payload and what is missing
+        self.flags = None
+        self.payload = None
+        self.target = None
+        self.closed = False
+
+    def read(self):
+        """ Yield the (flags, payload) completed with the data available.
+        Raise ConnectionResetError if kd5 closed the connection. """
+
+        if self.closed:
+            raise ConnectionResetError('Connection closed by kd5')
+
+        while True:
+            if self.target is not None:
+                n = self.recv(self.target)
+                self.target = self.target[n:]
+                if len(self.target):
+                    return
+                self.target = None
+                yield self.complete(self.flags, self.payload)
+
+            yield from self.parse()
+            if self.target is not None:
+                continue
+
+            # Keep the start of the next frame at the front of the buffer
+            if self.start:
+                left = self.end - self.start
+                self.buffer[:left] = self.view[self.start:self.end]
+                self.start, self.end = 0, left
+
+            n = self.recv(self.view[self.end:])
+            self.end += n
+            if not n:
+                return
+
+    def recv(self, view):
+        """ Receive into **view**. Return 0 if nothing is available or if the
+        connection is closed. """
+
+        try:
+            n = self.sock.recv_into(view)
+        except BlockingIOError:
+            return 0
+        if not n:
+            self.closed = True
+        return n
+
+    def parse(self):
+        """ Yield the complete frames of the buffer. Start receiving in place
+        the payload of a frame which does not fit in it. """
+
+        while self.end - self.start >= HEADER.size:
+            size, flags = HEADER.unpack_from(self.buffer, self.start)
+            head = HEADER.size
+
+            if flags & FLAG_BINARY and self.into:
+                head += RID.size
+                if self.end - self.start < head:
+                    return
+                payload = RID.unpack_from(self.buffer, self.start + HEADER.size)[0]
+                size -= RID.size
+                target = self.into(payload, size)
+            elif HEADER.size + size <= len(self.buffer):
+                if self.end - self.start < HEADER.size + size:
+                    return
+                begin = self.start + HEADER.size
+                self.start = begin + size
+                yield self.complete(flags, bytes(self.view[begin:self.start]))
+                continue
+            else:
+                payload = bytearray(size)
+                target = memoryview(payload)
+
+            # Payload received in place : copy what is already there
+            begin = self.start + head
+            got = min(size, self.end - begin)
+            target[:got] = self.view[begin:begin + got]
+            self.start = begin + got
+            if got < size:
+                self.flags, self.payload, self.target = flags, payload, target[got:]
+                return
+            yield self.complete(flags, payload)
+
+    def complete(self, flags, payload):
+        """ Complete frame : (flags, rid) for binary frames received in place,
+        (flags, decoded payload) otherwise """
+
+        if isinstance(payload, int):
+            return flags, payload
+
+        return flags, decode(flags, payload, self.codec)
@@ -112,9 +112,18 @@ class cfg_setup:
         self.cfg.add_section('comm')
         self.cfg.set('comm', 's-port', 15557)
         self.cfg.set('comm', 'r-port', 15556)
+        self.cfg.set('comm', 'array-transport', 'socket')
+        self.cfg.set('comm', 'transport', 'unix')
+        self.cfg.set('comm', 'compression', 'none')
+        self.cfg.set('comm', 'compression-threshold', 8192)
+        self.cfg.set('comm', 'heartbeat', 2)
 
         self.cfg.add_section('daemon')
-        self.cfg.set('daemon', 'refresh', 0.1)
+        self.cfg.set('daemon', 'busy-refresh', 1)
+        self.cfg.set('daemon', 'debounce', 0.05)
+        self.cfg.set('daemon', 'kernels', 'current')
+        self.cfg.set('daemon', 'metrics-file', '')
+        self.cfg.set('daemon', 'pool', 0)
 
         self.cfg.add_section('kernel version')
         self.cfg.set('kernel version', 'version', '3')
@@ -157,11 +166,35 @@ class cfg_setup:
             else:
                 kver = 3
 
-            # Refresh delay
-            if self.cfg.has_option('daemon', 'refresh'):
-                delay = self.cfg.get('daemon', 'refresh')
+            # Refresh delay while the kernel is busy
+            if self.cfg.has_option('daemon', 'busy-refresh'):
+                busy_refresh = self.cfg.get('daemon', 'busy-refresh')
             else:
-                delay = 0.1
+                busy_refresh = 1
+
+            # Refreshes requested within this delay are merged
+            if self.cfg.has_option('daemon', 'debounce'):
+                debounce = self.cfg.get('daemon', 'debounce')
+            else:
+                debounce = 0.05
+
+            # Kernels watched by the daemon : current | all | kernel ids
+            if self.cfg.has_option('daemon', 'kernels'):
+                kernels = self.cfg.get('daemon', 'kernels')
+            else:
+                kernels = 'current'
+
+            # Prometheus text file updated by kd5 (empty : not written)
+            if self.cfg.has_option('daemon', 'metrics-file'):
+                metrics_file = self.cfg.get('daemon', 'metrics-file')
+            else:
+                metrics_file = ''
+
+            # Spare kernels kept ready by the daemon
+            if self.cfg.has_option('daemon', 'pool'):
+                pool = self.cfg.get('daemon', 'pool')
+            else:
+                pool = 0
 
             # COMM
             if self.cfg.has_option('comm', 'r-port'):
@@ -174,6 +207,35 @@ class cfg_setup:
             else:
                 sport = 15555
 
+            # Arrays sent through the request socket or shared memory
+            if self.cfg.has_option('comm', 'array-transport'):
+                transport = self.cfg.get('comm', 'array-transport')
+            else:
+                transport = 'socket'
+
+            # Connection to the daemon : unix sockets or tcp (localhost)
+            if self.cfg.has_option('comm', 'transport'):
+                comm_transport = self.cfg.get('comm', 'transport')
+            else:
+                comm_transport = 'unix'
+
+            # Codecs offered to kd5 and size above which kd5 compresses frames
+            if self.cfg.has_option('comm', 'compression'):
+                compression = self.cfg.get('comm', 'compression')
+            else:
+                compression = 'none'
+
+            if self.cfg.has_option('comm', 'compression-threshold'):
+                threshold = self.cfg.get('comm', 'compression-threshold')
+            else:
+                threshold = 8192
+
+            # Seconds between two pings of kd5
+            if self.cfg.has_option('comm', 'heartbeat'):
+                heartbeat = self.cfg.get('comm', 'heartbeat')
+            else:
+                heartbeat = 2
+
             # WARNING COLORS
             if self.cfg.has_option('warning colors', 'text'):
                 wg_txt = self.cfg.get('warning colors', 'text')
@@ -317,8 +379,17 @@ class cfg_setup:
                                     'ascii-font': ascii},
                            'kernel version': {'version': kver},
                            'comm': {'s-port': sport,
-                                    'r-port': rport},
-                           'daemon': {'refresh': delay}}
+                                    'r-port': rport,
+                                    'array-transport': transport,
+                                    'transport': comm_transport,
+                                    'compression': compression,
+                                    'compression-threshold': threshold,
+                                    'heartbeat': heartbeat},
+                           'daemon': {'busy-refresh': busy_refresh,
+                                      'debounce': debounce,
+                                      'kernels': kernels,
+                                      'metrics-file': metrics_file,
+                                      'pool': pool}}
 
             # Init save Directory
             self.check_dir(self.save_dir)
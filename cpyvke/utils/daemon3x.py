@@ -41,26 +41,45 @@ import os
 import time
 import atexit
 import signal
+import select
 
 
 class Daemon:
     """A generic daemon class.
-    Usage: subclass the daemon class and override the run() method."""
+    Usage: subclass the daemon class and override the run() method.
+    run() calls ready() once the daemon serves : start() returns then."""
+
+    # Time the daemon has to be ready (s)
+    READY_TIMEOUT = 120
+
+    # Write end of the pipe to the first parent, until ready() is called
+    readyfd = None
 
     def __init__(self, pidfile):
         self.pidfile = pidfile
 
     def daemonize(self):
-        """Deamonize class. UNIX double fork mechanism."""
+        """Deamonize class. UNIX double fork mechanism.
+        The first parent exits once the daemon is ready, with status 0, or
+        with status 1 if it exited or timed out before."""
+        readfd, self.readyfd = os.pipe()
         try:
             pid = os.fork()
             if pid > 0:
-                # exit first parent
-                sys.exit(0)
+                # wait for the daemon, then exit first parent
+                os.close(self.readyfd)
+                status = b''
+                if select.select([readfd], [], [], self.READY_TIMEOUT)[0]:
+                    status = os.read(readfd, 16)
+                if status != b'ready':
+                    sys.stderr.write('Daemon not ready, see its log\n')
+                sys.exit(0 if status == b'ready' else 1)
         except OSError as err:
             sys.stderr.write('fork #1 failed: {0}\n'.format(err))
             sys.exit(1)
 
+        os.close(readfd)
+
         # decouple from parent environment
         os.chdir('/')
         os.setsid()
@@ -97,6 +116,13 @@ class Daemon:
     def delpid(self):
         os.remove(self.pidfile)
 
+    def ready(self):
+        """Tell the process which started the daemon that it is ready."""
+        if self.readyfd is not None:
+            os.write(self.readyfd, b'ready')
+            os.close(self.readyfd)
+            self.readyfd = None
+
     def start(self):
         """Start the daemon."""
 
@@ -52,20 +52,6 @@ def str_format(string, width):
     return output
 
 
-def whos_to_dic(string):
-    """ Format output of daemon to a dictionnary """
-
-    variables = {}
-    for item in string.split('\n')[2:]:
-        tmp = [j for j in item.split(' ') if j is not '']
-        if tmp:
-            var_name = tmp[0]
-            var_typ = tmp[1]
-            var_val = ' '.join(tmp[2:])
-            variables[var_name] = {'value': var_val, 'type': var_typ}
-    return variables
-
-
 def dump(obj, nested_level=0, output=[]):
     """ Format dict, list and tuples variables for displaying. """
 
@@ -131,43 +117,20 @@ def format_variable(variables, name, screen_width):
     """ Format regular variables """
 
     max_width = int(screen_width/5)
+    record = variables[name]
 
-    # Types
-    if "@<class '" in variables[name]['type']:
-        typ = '[inst. ' + variables[name]['type'].split("'")[1] + ']'
-    elif "<class '" in variables[name]['type']:
-        typ = '[' + variables[name]['type'].split("'")[1] + ']'
-    else:
-        typ = '[' + variables[name]['type'] + ']'
-
-    # Only display module name
-    if 'module' in variables[name]['value']:
-        val = variables[name]['value'].split("'")[1]
+    typ = '[' + record['type'] + ']'
 
-    # Only display dimensions of array
-    elif 'elem' in variables[name]['value']:
-        val1 = variables[name]['value'].split(":")[0]
-        val2 = variables[name]['value'].split("`")[1]
-        val = val1 + ' [' + val2 + ']'
+    # Only display dimensions of array (scalars have no dimension)
+    if 'dtype' in record and record['shape']:
+        val = 'x'.join(str(i) for i in record['shape']) + ' [' + record['dtype'] + ']'
 
-    elif 'classmethod' in variables[name]['value']:
-        val = 'classmethod'
-
-    elif 'staticmethod' in variables[name]['value']:
-        val = 'staticmethod'
-
-    elif ' at' in variables[name]['value']:
-        val = variables[name]['value'].split(' at ')[0] + '>'
-
-    elif 'frozenset' in variables[name]['value']:
-        val = variables[name]['value'].split('(')[1].split(')')[0]
-
-    elif '<...>' in variables[name]['value']:
-        val = variables[name]['value'].split('<')[0] + '...'
+    # Drop addresses of functions, instances, ...
+    elif ' at 0x' in record['value']:
+        val = record['value'].split(' at 0x')[0] + '>'
 
     else:
-        # Repr to avoid interpreting \n in strings
-        val = variables[name]['value']
+        val = record['value']
 
     # Check length of each entry
     if len(val) > 3*max_width:
@@ -191,6 +154,12 @@ def format_kernel(variables, name, screen_width):
     max_width = int(screen_width/5)
     typ = '[' + variables[name]['type'] + ']'
 
+    # Responsiveness of the heartbeat, if there is room for it
+    if 'rtt' in variables[name]:
+        rtt = ' {:.1f} ms'.format(1e3*variables[name]['rtt'])
+        if len(typ + rtt) <= max_width:
+            typ += rtt
+
     # Repr to avoid interpreting \n in strings
     val = variables[name]['value']
 
@@ -0,0 +1,233 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 23:02:48 CEST
+# Last Modified : dim. 18 oct. 2026 23:02:48 CEST
+"""
+-----------
+DOCSTRING
+
+Liveness of kernels from their heartbeat channel.
+
+The heartbeat of a Jupyter kernel echoes every message it receives on hb_port,
+from a thread of its own : it answers while a cell is running. A kernel is
+alive if it echoes a ping within PING_TIMEOUT s, and the round trip time tells
+how responsive it is.
+
+Heartbeat keeps one REQ socket per kernel from one round of pings to the next.
+The socket of a kernel which did not answer is closed (a REQ socket waiting
+for its reply cannot send again) and opened again at the next round.
+
+HeartbeatThread pings the kernels in the background, so that the interface
+never waits for a dead kernel.
+
+@author: Cyril Desjouy
+"""
+
+import logging
+import threading
+from time import monotonic
+import zmq
+
+logger = logging.getLogger("cpyvke.heartbeat")
+
+
+# Time a kernel has to echo a ping (s)
+PING_TIMEOUT = 0.5
+
+# Seconds between two rounds of pings of HeartbeatThread
+INTERVAL = 3
+
+
+def endpoint(info):
+    """ ZMQ endpoint of the heartbeat channel, from connection **info** """
+
+    if info.get('transport', 'tcp') == 'ipc':
+        return 'ipc://{}-{}'.format(info['ip'], info['hb_port'])
+
+    ip = info.get('ip', '127.0.0.1')
+    if ip in ('0.0.0.0', '*', ''):
+        ip = '127.0.0.1'
+
+    return 'tcp://{}:{}'.format(ip, int(info['hb_port']))
+
+
+class Heartbeat:
+    """ Heartbeat sockets of kernels """
+
+    def __init__(self, timeout=PING_TIMEOUT, context=None):
+
+        self.timeout = timeout
+        self.context = context or zmq.Context.instance()
+        # {connection file: (endpoint, REQ socket)}
+        self.sockets = {}
+
+    def socket(self, cf, info):
+        """ Socket of kernel **cf**, connected to the endpoint of **info** """
+
+        address = endpoint(info)
+        if cf in self.sockets:
+            if self.sockets[cf][0] == address:
+                return self.sockets[cf][1]
+            self.drop(cf)
+
+        sock = self.context.socket(zmq.REQ)
+        sock.linger = 0
+        sock.connect(address)
+        self.sockets[cf] = (address, sock)
+
+        return sock
+
+    def drop(self, cf):
+        """ Close the socket of kernel **cf** """
+
+        _, sock = self.sockets.pop(cf)
+        sock.close()
+
+    def ping(self, infos):
+        """ Ping all the kernels of **infos** {connection file: connection info}
+        at once. Return {connection file: round trip time (s), or None if the
+        kernel did not answer within timeout}. """
+
+        for cf in set(self.sockets) - set(infos):
+            self.drop(cf)
+
+        rtts = dict.fromkeys(infos)
+        poller = zmq.Poller()
+        pending = {}
+
+        for cf, info in infos.items():
+            try:
+                sock = self.socket(cf, info)
+                sock.send(b'ping', zmq.NOBLOCK)
+            except (KeyError, ValueError, TypeError, zmq.ZMQError):
+                if cf in self.sockets:
+                    self.drop(cf)
+                continue
+            pending[sock] = (cf, monotonic())
+            poller.register(sock, zmq.POLLIN)
+
+        deadline = monotonic() + self.timeout
+        while pending:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            for sock, _ in poller.poll(1e3*remaining):
+                cf, sent = pending.pop(sock)
+                sock.recv()
+                rtts[cf] = monotonic() - sent
+                poller.unregister(sock)
+
+        for cf, _ in pending.values():
+            self.drop(cf)
+
+        return rtts
+
+    def close(self):
+        """ Close all sockets """
+
+        for cf in list(self.sockets):
+            self.drop(cf)
+
+
+def ping(infos, timeout=PING_TIMEOUT):
+    """ One round of pings of **infos** (see Heartbeat.ping) """
+
+    heartbeat = Heartbeat(timeout)
+    try:
+        return heartbeat.ping(infos)
+    finally:
+        heartbeat.close()
+
+
+class HeartbeatThread(threading.Thread):
+    """ Ping the watched kernels every **interval** s in the background """
+
+    def __init__(self, interval=INTERVAL, timeout=PING_TIMEOUT):
+        super(HeartbeatThread, self).__init__(name='cpyvke-heartbeat')
+
+        self.daemon = True
+        self.interval = interval
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        # Kernels to ping : {connection file: connection info}
+        self.infos = {}
+        # Last answers : {connection file: round trip time or None}
+        self.rtts = {}
+        self.wake = False
+        self.stopped = False
+        self.start()
+
+    def watch(self, infos):
+        """ Ping the kernels of **infos** from now on. New or changed ones are
+        pinged at once. """
+
+        with self.cond:
+            self.wake |= infos != self.infos
+            self.rtts = {cf: rtt for cf, rtt in self.rtts.items()
+                         if self.infos.get(cf) == infos.get(cf)}
+            self.infos = dict(infos)
+            self.cond.notify_all()
+
+    def expire(self):
+        """ Ping all the kernels again now """
+
+        with self.cond:
+            self.wake = True
+            self.cond.notify_all()
+
+    def results(self):
+        """ {connection file: round trip time or None} of the kernels which
+        were pinged since they are watched """
+
+        with self.cond:
+            return dict(self.rtts)
+
+    def run(self):
+
+        heartbeat = Heartbeat(self.timeout)
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.wake or self.stopped, self.interval)
+                    if self.stopped:
+                        return
+                    self.wake = False
+                    infos = dict(self.infos)
+
+                rtts = heartbeat.ping(infos)
+
+                with self.cond:
+                    # Kernels whose connection info changed meanwhile are pinged again
+                    self.rtts.update({cf: rtt for cf, rtt in rtts.items()
+                                      if self.infos.get(cf) == infos[cf]})
+                    self.cond.notify_all()
+        except Exception:
+            logger.error('Heartbeat stopped', exc_info=True)
+        finally:
+            heartbeat.close()
+
+    def close(self):
+        """ Stop pinging """
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
@@ -28,18 +28,17 @@ DOCSTRING
 @author: Cyril Desjouy
 """
 
+import ast
 import curses
 from matplotlib.pyplot import figure, plot, imshow, show
 import numpy as np
-import os
-from time import time, sleep
+from time import time
 from multiprocessing import Process
 import subprocess
 import sys
 import locale
 from inspect import getsource
 from cpyvke.curseswin.widgets import suspend_curses
-from cpyvke.utils.comm import send_msg
 
 
 locale.setlocale(locale.LC_ALL, '')
@@ -257,103 +256,102 @@ class ProceedInspection:
     def get_function_doc(self):
         """ Get function __doc__ """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str({}.__doc__))".format(self.filename, self.varname)
         try:
-            send_msg(self.sock.RequestSock, '<code>' + self.code)
-            self.logger.debug("Inspecting '{}' with type '{}'".format(self.varname, self.vartype))
-            self.wait()
-            with open(self.filename, 'r') as f:
-                self.doc = f.read()
+            self.doc = self.evaluate('str({}.__doc__)'.format(self.varname))
         except Exception:
             self.logger.error('Get traceback', exc_info=True)
             self.kernel_busy()
         else:
             self.logger.debug('kd5 answered : {}'.format(self.varval))
-            os.remove(self.filename)
             self._ismenu = True
 
     def get_function_code(self):
         """ Get function __doc__ """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str(_inspect.getsource({})))".format(self.filename, self.varname)
+        self.expr = 'str(_inspect.getsource({}))'.format(self.varname)
         self.send_code()
 
     def get_class_instance(self):
         """ Get Class characteristics. """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str(_inspect.inspect_class_instance({})))".format(self.filename, self.varname)
+        self.expr = 'str(_inspect.inspect_class_instance({}))'.format(self.varname)
         self.send_code()
 
     def get_class(self):
         """ Get Class characteristics. """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str(_inspect.inspect_class({})))".format(self.filename, self.varname)
+        self.expr = 'str(_inspect.inspect_class({}))'.format(self.varname)
         self.send_code()
 
     def get_module(self):
         """ Get modules characteristics """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str({}.__name__))".format(self.filename, self.varname)
+        self.expr = 'str({}.__name__)'.format(self.varname)
         self.send_code()
 
     def get_structure(self):
         """ Get Dict/List/Tuple characteristics """
 
-        self.filename = '/tmp/tmp_' + self.varname
-        self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str({}))".format(self.filename, self.varname)
+        self.expr = 'str({})'.format(self.varname)
         self.send_code()
 
     def get_ndarray(self):
         """ Get ndarray characteristics. """
 
-        self.filename = '/tmp/tmp_' + self.varname + '.npy'
-        code = "_np.save('" + self.filename + "', " + self.varname + ')'
+        shm = self.app.config['comm']['array-transport'] == 'shm'
         try:
-            send_msg(self.sock.RequestSock, '<code>' + code)
-            self.logger.debug("Name of module '{}' asked to kd5".format(self.varname))
-            self.wait()
-            self.varval = np.load(self.filename)
+            rid = self.sock.request('array', name=self.varname, shm=shm)
+            self.logger.debug("Array '{}' asked to kd5".format(self.varname))
+            self.varval = self.check_reply(self.wait(rid))['array']
         except Exception:
             self.logger.error('Get traceback : ', exc_info=True)
             self.kernel_busy()
         else:
             self.logger.debug('kd5 answered')
-            os.remove(self.filename)
             self._ismenu = True
 
     def get_help(self):
         """ Help item in menu """
 
         if self.vartype == 'function':
-            self.filename = '/tmp/tmp_' + self.varname
-            self.code = "with open('{}' , 'w') as fcpyvke0:\n\tfcpyvke0.write(str({}.__doc__))".format(self.filename, self.varname)
+            self.expr = 'str({}.__doc__)'.format(self.varname)
             self.send_code()
 
     def send_code(self):
-        """ Send code to kernel and except answer ! """
+        """ Send expression to kernel and except answer ! """
 
         try:
-            send_msg(self.sock.RequestSock, '<code>' + self.code)
-            self.logger.debug("Inspecting '{}' with type '{}'".format(self.varname, self.vartype))
-            self.wait()
-            with open(self.filename, 'r') as f:
-                if self.vartype in ['str', 'function', 'module', 'builtin_function_or_method']:
-                    self.varval = f.read()
-                else:
-                    self.varval = eval(f.read())
+            value = self.evaluate(self.expr)
+            if self.vartype in ['str', 'function', 'module', 'builtin_function_or_method']:
+                self.varval = value
+            else:
+                self.varval = eval(value)
         except Exception:
             self.logger.error('Get traceback', exc_info=True)
             self.kernel_busy()
         else:
             self.logger.debug('kd5 answered : {}'.format(self.varval))
-            os.remove(self.filename)
             self._ismenu = True
 
+    def evaluate(self, expr):
+        """ Evaluate **expr** (a str) in the kernel and return its value """
+
+        rid = self.sock.request('eval', expr=expr)
+        self.logger.debug("Inspecting '{}' with type '{}'".format(self.varname, self.vartype))
+
+        return ast.literal_eval(self.check_reply(self.wait(rid))['value'])
+
+    def check_reply(self, reply):
+        """ Raise if the daemon did not answer or if the request failed """
+
+        if reply is None:
+            raise TimeoutError('No answer from kd5')
+
+        if reply['status'] != 'ok':
+            raise RuntimeError('kd5 answered {status} : {error}'.format(**reply))
+
+        return reply
+
     def kernel_busy(self):
         """ Handle silent kernel. """
 
@@ -361,8 +359,9 @@ class ProceedInspection:
         self.varval = '[Busy]'
         self._ismenu = False
 
-    def wait(self):
-        """ Wait for variable value. """
+    def wait(self, rid):
+        """ Wait for the reply to request **rid**. None if it does not come.
+        Arrays may take long : only give up if nothing came for 3 s. """
 
         i, j = 0, 0
         spinner = [['.', 'o', 'O', 'o'],
@@ -392,11 +391,22 @@ class ProceedInspection:
         search = spinner[21]
         spinner = spinner[19]
         ti = time()
-        while os.path.exists(self.filename) is False:
+        progress = None
+        reply = self.sock.reply(rid)
+        while reply is None:
             self.app.stdscr.addstr(self.position + 1 - (self.page-1)*self.app.row_max, 1,
                                    spinner[i], self.app.c_exp_txt | curses.A_BOLD)
-            self.app.stdscr.addstr(self.app.screen_height - 1, 0,
-                                   search[j], self.app.c_exp_txt | curses.A_DIM)
+
+            if self.sock.progress(rid) != progress:
+                ti = time()
+                progress = self.sock.progress(rid)
+            if progress:
+                self.app.stdscr.addstr(self.app.screen_height - 1, 0,
+                                       'Receiving... {:3.0f}%'.format(100*progress[0]/progress[1]),
+                                       self.app.c_exp_txt | curses.A_DIM)
+            else:
+                self.app.stdscr.addstr(self.app.screen_height - 1, 0,
+                                       search[j], self.app.c_exp_txt | curses.A_DIM)
 
             self.app.stdscr.refresh()
             if i < len(spinner) - 1:
@@ -412,6 +422,8 @@ class ProceedInspection:
             if time() - ti > 3:
                 break
 
-            sleep(0.05)
+            reply = self.sock.reply(rid, timeout=0.05)
 
         self.app.stdscr.refresh()
+
+        return reply
@@ -33,6 +33,9 @@ import sys
 import psutil
 import subprocess
 
+# Spare kernels of kd5 (see kd5.KernelPool)
+POOL_FILE = os.path.expanduser("~") + "/.cpyvke/kd5.pool"
+
 
 def kd_status(pidfile):
     """ Check kd5 status """
@@ -90,6 +93,22 @@ def kdwrite(cfile, content):
         f.write(content)
 
 
+def read_pool(poolfile):
+    """ Kernel ids listed in poolfile """
+
+    try:
+        with open(poolfile, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def write_pool(poolfile, kids):
+    """ List kernel ids in poolfile """
+
+    kdwrite(poolfile, ''.join(kid + '\n' for kid in kids))
+
+
 def is_kd_running(pidfile):
     """ Check if process with pid (in pidfile) is actually running"""
 
@@ -29,59 +29,129 @@ DOCSTRING
 """
 
 
-from jupyter_client import BlockingKernelClient, manager
+from jupyter_client import BlockingKernelClient, manager, write_connection_file
+from jupyter_client.session import new_id_bytes
+from jupyter_core.paths import jupyter_runtime_dir
 import os
 import sys
+import json
+import uuid
 import subprocess
 import psutil
 import logging
-import socket
 import time
 
+from cpyvke.utils.heartbeat import ping, PING_TIMEOUT
+from cpyvke.utils.kd import read_pool, POOL_FILE
+
 logger = logging.getLogger("cpyvke.ktools")
 
+# Directories where kernels write their connection file
+RUNTIME_DIRS = (os.path.expanduser('~/.local/share/jupyter/runtime/'),
+                '/run/user/{}/jupyter/'.format(os.getuid()))
 
-def start_new_kernel(LogDir=os.path.expanduser("~") + "/.cpyvke/", version=3):
-    """ Start a new kernel and return the kernel id """
+# Time a new kernel has to answer kernel_info (s)
+START_TIMEOUT = 60
 
-    with open(LogDir + 'kd5.lock', "w") as f:
-        if version == '2':
-            subprocess.Popen(["ipython", "kernel"], stdout=f)
-        else:
-            subprocess.Popen(["ipython3", "kernel"], stdout=f)
+# Round trip time of a kernel which was not pinged yet
+PENDING = 'pending'
 
-    time.sleep(1)
 
-    with open(LogDir + 'kd5.lock', "r") as f:
-        kid = f.read().split('kernel-')[1].split('.json')[0]
+def start_new_kernel(version=3, timeout=START_TIMEOUT):
+    """ Start a new kernel and return the kernel id once it answers
+    kernel_info requests. Raise RuntimeError if it does not within **timeout** s. """
 
-    with open(LogDir + 'kd5.lock', "w") as f:
-        f.write(kid)
+    start = time.monotonic()
+    kid, cf = new_connection_file()
+    process = subprocess.Popen(kernel_command(cf, version), stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    launched = time.monotonic()
 
-    logger.info('Create :: Kernel id. {}'.format(kid))
+    kc = BlockingKernelClient()
+    kc.load_connection_file(cf)
+    kc.start_channels()
+    try:
+        # A kernel busy starting may miss heartbeats : only its exit is final
+        deadline = launched + timeout
+        while True:
+            try:
+                kc.wait_for_ready(timeout=1)
+                break
+            except RuntimeError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    process.kill()
+                    if os.path.exists(cf):
+                        os.remove(cf)
+                    raise RuntimeError('Kernel {} did not start'.format(kid))
+    finally:
+        kc.stop_channels()
+
+    logger.info('Create :: Kernel id. {} ready in {:.3f} s (launch {:.3f} s, kernel_info {:.3f} s)'.format(
+        kid, time.monotonic() - start, launched - start, time.monotonic() - launched))
 
     return kid
 
 
+def new_connection_file():
+    """ Id and connection file of a kernel to start. The file is written at
+    once, with free ports : the kernel binds them instead of choosing its own. """
+
+    runtime = jupyter_runtime_dir()
+    os.makedirs(runtime, exist_ok=True)
+    kid = str(uuid.uuid4())
+    cf = os.path.join(runtime, 'kernel-{}.json'.format(kid))
+    write_connection_file(cf, ip='127.0.0.1', key=new_id_bytes())
+
+    return kid, cf
+
+
+def kernel_command(cf, version=3):
+    """ Command starting a kernel which writes its connection file **cf** """
+
+    return ['ipython' if str(version) == '2' else 'ipython3', 'kernel', '-f', cf]
+
+
 def is_runing(cf):
     """ Check if kernel is alive.
     """
 
-    kc = BlockingKernelClient()
-    kc.load_connection_file(cf)
-    port = kc.get_connection_info()['iopub_port']
+    return are_running([cf])[0]
 
-    # if check_server(port):
-    if is_open("127.0.0.1", port):
-        return True
-    else:
-        return False
+
+def are_running(cfs, timeout=PING_TIMEOUT):
+    """ Check if the kernels of connection files **cfs** are alive.
+    All are pinged at once : the answer comes within **timeout** s. """
+
+    return [rtt is not None for rtt in ping_kernels(cfs, timeout)]
+
+
+def ping_kernels(cfs, timeout=PING_TIMEOUT):
+    """ Round trip times (s) of the heartbeats of the kernels of connection
+    files **cfs**. None for the kernels which did not answer within **timeout**. """
+
+    infos = {}
+    for cf in cfs:
+        try:
+            infos[cf] = connection_info(cf)
+        except (OSError, ValueError):
+            continue
+
+    rtts = ping(infos, timeout)
+
+    return [rtts.get(cf) for cf in cfs]
+
+
+def connection_info(cf):
+    """ Content of connection file **cf** """
+
+    with open(cf) as f:
+        return json.load(f)
 
 
 def check_server(port):
     """ Check if a service is listening on port.
 
-    NOTE : Too slow for curses interface -> replaced by socket tests : is_open()
+    NOTE : Too slow for curses interface -> replaced by heartbeat pings : is_runing()
 
     """
 
@@ -92,41 +162,33 @@ def check_server(port):
         return False
 
 
-def is_open(ip, port):
-    """ Check if port is open on ip """
+def set_kid(cf):
+    return cf.split('kernel-')[1].split('.json')[0]
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        s.connect((ip, int(port)))
-        s.shutdown(2)
-        return True
-    except socket.error:
-        return False
 
+def connection_files(path=None):
+    """ Connection files of the runtime directories (or of **path** only).
+    Spare kernels of kd5 are not listed. """
 
-def set_kid(cf):
-    return cf.split('kernel-')[1].split('.json')[0]
+    spares = read_pool(POOL_FILE)
+    files = []
+    for path in [path] if path else RUNTIME_DIRS:
+        try:
+            files += [path + item for item in os.listdir(path) if 'kernel' in item
+                      and not any(kid in item for kid in spares)]
+        except FileNotFoundError:
+            pass
+
+    return files
 
 
 def kernel_list(cf=None):
     """ List of connection files. """
 
-    try:
-        path = os.path.expanduser('~/.local/share/jupyter/runtime/')
-        lstk1 = [path + item for item in os.listdir(path) if 'kernel' in item]
-    except FileNotFoundError:
-        lstk1 = []
-
-    try:
-        path = '/run/user/1000/jupyter/'
-        lstk2 = [path + item for item in os.listdir(path) if 'kernel' in item]
-    except FileNotFoundError:
-        lstk2 = []
-
-    lstk = lstk1 + lstk2
+    lstk = connection_files()
 
     try:
-        lst = [(item, '[Alive]' if is_runing(item) else '[Died]') for item in lstk]
+        lst = [(item, '[Alive]' if alive else '[Died]') for item, alive in zip(lstk, are_running(lstk))]
     except Exception:
         logger.error('No kernel available', exc_info=True)
         return []
@@ -139,29 +201,34 @@ def kernel_dic(cf=None):
         {'name': {'value': val, 'type': 'type'}}
     """
 
-    try:
-        path = os.path.expanduser('~/.local/share/jupyter/runtime/')
-        lstk1 = [path + item for item in os.listdir(path) if 'kernel' in item]
-    except FileNotFoundError:
-        lstk1 = []
-
-    try:
-        path = '/run/user/1000/jupyter/'
-        lstk2 = [path + item for item in os.listdir(path) if 'kernel' in item]
-    except FileNotFoundError:
-        lstk2 = []
-
-    lstk = lstk1 + lstk2
+    lstk = connection_files()
 
     try:
-        return {set_kid(item): {'value': item, 'type': 'Connected'} if is_runing(item) and item == cf
-                else {'value': item, 'type': 'Alive'} if is_runing(item)
-                else {'value': item, 'type': 'Died'} for item in lstk}
+        return kernel_items(zip(lstk, ping_kernels(lstk)), cf)
     except Exception:
         logger.error('No kernel available', exc_info=True)
         return {}
 
 
+def kernel_items(kernels, cf=None):
+    """ kernel_dic() of the (connection file, round trip time) pairs **kernels**.
+    Dead kernels have no round trip time (None), kernels not pinged yet have
+    PENDING. """
+
+    items = {}
+    for item, rtt in kernels:
+        if rtt == PENDING:
+            items[set_kid(item)] = {'value': item,
+                                    'type': 'Connected' if item == cf else 'Pending'}
+        elif rtt is None:
+            items[set_kid(item)] = {'value': item, 'type': 'Died'}
+        else:
+            items[set_kid(item)] = {'value': item, 'rtt': rtt,
+                                    'type': 'Connected' if item == cf else 'Alive'}
+
+    return items
+
+
 def print_kernel_list():
     """ Display kernel list. """
     klst = kernel_list()
@@ -190,22 +257,24 @@ def print_kernel_dic():
     print(79*'-')
 
 
-def connect_kernel(cf):
-    """ Connect a kernel. """
+def connect_kernel(cf, client_class=BlockingKernelClient, init=True):
+    """ Connect a kernel. Start it if it is not running. The kernel is
+    initialized (see init_kernel) if **init** is True. """
 
     if is_runing(cf):
-        kc = BlockingKernelClient(connection_file=cf)
-        kc.load_connection_file(cf)
         km = None
 
     else:
         # Kernel manager
         km = manager.KernelManager(connection_file=cf)
         km.start_kernel()
-        # Kernel Client
-        kc = km.blocking_client()
 
-    init_kernel(kc)
+    # Kernel Client
+    kc = client_class(connection_file=cf)
+    kc.load_connection_file(cf)
+
+    if init:
+        init_kernel(kc)
 
     return km, kc
 
@@ -224,14 +293,21 @@ def connect_kernel_as_manager(cf):
 
 
 def init_kernel(kc, backend='tk'):
-    """ init communication. """
+    """ init communication. Executions are silent : they are not broadcast as
+    user inputs. Return their msg ids. """
 
     backend = 'tk'
 
-    kc.execute("import numpy as _np", store_history=False)
-    kc.execute("_np.set_printoptions(threshold={})".format(sys.maxsize), store_history=False)
-    kc.execute("%matplotlib {}".format(backend), store_history=False)
-    kc.execute("import cpyvke.utils.inspector as _inspect", store_history=False)
+    msg_ids = [kc.execute(code, silent=True, store_history=False)
+               for code in ("import numpy as _np",
+                            "_np.set_printoptions(threshold={})".format(sys.maxsize),
+                            "import cpyvke.utils.inspector as _inspect",
+                            "import cpyvke.utils.agent as _agent")]
+    # Backend may be missing : do not abort the requests queued after this one
+    msg_ids.append(kc.execute("%matplotlib {}".format(backend), silent=True,
+                              store_history=False, stop_on_error=False))
+
+    return msg_ids
 
 
 def shutdown_kernel(cf):
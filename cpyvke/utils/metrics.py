@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 20:41:09 CEST
+# Last Modified : dim. 18 oct. 2026 20:41:09 CEST
+"""
+-----------
+DOCSTRING
+
+Counters, gauges and latency histograms of kd5.
+
+Metrics are identified by a name and optional labels :
+
+    metrics.inc('requests', type='eval')
+    metrics.observe('snapshot_seconds', 0.012, source='agent')
+
+dump() returns them as a json-able dict (answer to a 'stats' request) and
+prometheus() renders such a dict in the Prometheus text format.
+
+@author: Cyril Desjouy
+"""
+
+import os
+from bisect import bisect_left
+
+
+# Prefix of the metric names in the Prometheus output
+PREFIX = 'kd5_'
+
+
+class Histogram:
+    """ Distribution of durations (seconds) in fixed buckets """
+
+    # Upper bounds of the buckets
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1., 2.5, 5., 10.)
+
+    def __init__(self):
+
+        # Last count is for values above the last bucket
+        self.counts = [0]*(len(self.BUCKETS) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        """ Count **value** """
+
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def dump(self):
+        """ Json-able state """
+
+        return {'buckets': list(self.BUCKETS),
+                'counts': list(self.counts),
+                'sum': self.sum,
+                'count': self.count}
+
+
+def quantile(histogram, q):
+    """ Estimate quantile **q** from a dumped **histogram**, interpolating
+    within the bucket it falls in. None if nothing was observed. """
+
+    if not histogram['count']:
+        return None
+
+    rank = q*histogram['count']
+    lower, seen = 0., 0
+    for upper, count in zip(histogram['buckets'] + [float('inf')], histogram['counts']):
+        if count and seen + count >= rank:
+            if upper == float('inf'):
+                return lower
+            return lower + (upper - lower)*(rank - seen)/count
+        seen += count
+        lower = upper
+
+    return lower
+
+
+def percentile(samples, q):
+    """ Nearest rank quantile **q** of **samples**. None if there is none. """
+
+    if not samples:
+        return None
+
+    ranked = sorted(samples)
+    return ranked[min(int(q*len(ranked)), len(ranked) - 1)]
+
+
+class Metrics:
+    """ Metrics of kd5 """
+
+    def __init__(self):
+
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        """ Key of metric **name** with **labels** """
+
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """ Increase counter **name** by **value** """
+
+        key = self.key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ Set gauge **name** """
+
+        self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """ Add **value** to histogram **name** """
+
+        key = self.key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def dump(self):
+        """ Json-able state of all metrics """
+
+        def entries(metrics, value):
+            return [dict(name=name, labels=dict(labels), **value(metric))
+                    for (name, labels), metric in sorted(metrics.items())]
+
+        return {'counters': entries(self.counters, lambda v: {'value': v}),
+                'gauges': entries(self.gauges, lambda v: {'value': v}),
+                'histograms': entries(self.histograms, Histogram.dump)}
+
+
+def labels(entry, **extra):
+    """ Prometheus labels of a dumped metric """
+
+    items = dict(entry['labels'], **extra)
+    if not items:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                          for k, v in sorted(items.items())) + '}'
+
+
+def prometheus(stats):
+    """ Prometheus text format of dumped metrics **stats** """
+
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for entry in stats['counters']:
+        name = PREFIX + entry['name'] + '_total'
+        declare(name, 'counter')
+        lines.append('{}{} {}'.format(name, labels(entry), entry['value']))
+
+    for entry in stats['gauges']:
+        name = PREFIX + entry['name']
+        declare(name, 'gauge')
+        lines.append('{}{} {}'.format(name, labels(entry), entry['value']))
+
+    for entry in stats['histograms']:
+        name = PREFIX + entry['name']
+        declare(name, 'histogram')
+        total = 0
+        for upper, count in zip(entry['buckets'] + ['+Inf'], entry['counts']):
+            total += count
+            lines.append('{}_bucket{} {}'.format(name, labels(entry, le=upper), total))
+        lines.append('{}_sum{} {}'.format(name, labels(entry), entry['sum']))
+        lines.append('{}_count{} {}'.format(name, labels(entry), entry['count']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(stats, path):
+    """ Write **stats** to **path** for a Prometheus textfile collector.
+    The file is replaced at once : it is never read half written. """
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(prometheus(stats))
+    os.replace(tmp, path)
+
+
+def report(stats):
+    """ Human readable summary of dumped metrics **stats** """
+
+    lines = []
+    for entry in stats['counters'] + stats['gauges']:
+        lines.append('{}{} : {}'.format(entry['name'], labels(entry), entry['value']))
+
+    for entry in stats['histograms']:
+        ms = ['{:.1f}'.format(1e3*quantile(entry, q)) for q in (0.5, 0.95, 0.99)]
+        lines.append('{}{} : {} obs., mean {:.1f} ms, p50/p95/p99 {} ms'.format(
+            entry['name'], labels(entry), entry['count'],
+            1e3*entry['sum']/entry['count'], '/'.join(ms)))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,164 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 10:12:41 CEST
+# Last Modified : dim. 18 oct. 2026 10:12:41 CEST
+"""
+-----------
+DOCSTRING
+
+Versioned namespace exchanged between kd5 and its clients.
+
+The daemon keeps the last snapshot of the kernel namespace and only sends what
+changed since the previous version :
+
+    {'version': n, 'full': True, 'variables': {name: record}}
+    {'version': n, 'base': n-1, 'add': {...}, 'update': {...}, 'remove': [...]}
+
+Both also carry the kernel 'execution_count' and monotonic timestamps of the
+end of the last cell ('executed'), of the scan in the kernel ('captured') and
+of the message ('sent'). The client adds the time it received it : the age of
+the namespace on screen and the latency from execution to screen are known.
+
+@author: Cyril Desjouy
+"""
+
+import json
+from time import monotonic
+
+
+def diff(old, new):
+    """ Return the (add, update, remove) triple turning **old** into **new** """
+
+    add = {k: v for k, v in new.items() if k not in old}
+    update = {k: v for k, v in new.items() if k in old and old[k] != v}
+    remove = [k for k in old if k not in new]
+
+    return add, update, remove
+
+
+class Snapshot:
+    """ Daemon side : last known namespace and its version. """
+
+    def __init__(self):
+
+        self.variables = {}
+        self.version = 0
+        self.execution_count = None
+        self.executed = None
+        self.captured = None
+
+    def update(self, variables, execution_count=None, executed=None, captured=None):
+        """ Store **variables** scanned at **captured** after execution
+        **execution_count** (ended at **executed**). Return the delta message
+        or None if nothing changed. A new execution leaving the namespace as
+        is still gives an (empty) delta : the client learns its view is up to
+        date. """
+
+        add, update, remove = diff(self.variables, variables)
+        new_execution = execution_count != self.execution_count
+        self.execution_count = execution_count
+        self.executed = executed
+        self.captured = captured
+        if not add and not update and not remove and not new_execution:
+            return None
+
+        self.variables = variables
+        self.version += 1
+
+        return self.message({'version': self.version,
+                             'base': self.version - 1,
+                             'add': add,
+                             'update': update,
+                             'remove': remove})
+
+    def full(self):
+        """ Full snapshot message. Sent on connection or resync. """
+
+        return self.message({'version': self.version,
+                             'full': True,
+                             'variables': self.variables})
+
+    def message(self, msg):
+        """ Json message **msg** with the freshness of the snapshot """
+
+        msg.update(execution_count=self.execution_count,
+                   executed=self.executed,
+                   captured=self.captured,
+                   sent=monotonic())
+
+        return json.dumps(msg)
+
+
+class Namespace:
+    """ Client side : local copy of the namespace built from daemon messages. """
+
+    def __init__(self):
+
+        self.variables = {}
+        self.version = None
+        # Freshness of the local copy
+        self.execution_count = None
+        self.executed = None
+        self.captured = None
+        self.sent = None
+        self.received = None
+        # Execution to reception time of the last execution
+        self.latency = None
+
+    def apply(self, msg):
+        """ Apply a snapshot or a delta (json string).
+        Return False if the delta does not follow the local version : the
+        client must then ask for a resync. """
+
+        received = monotonic()
+        msg = json.loads(msg)
+
+        if msg.get('full'):
+            self.variables = msg['variables']
+        elif msg['base'] != self.version:
+            return False
+        else:
+            for name in msg['remove']:
+                self.variables.pop(name, None)
+            self.variables.update(msg['add'])
+            self.variables.update(msg['update'])
+
+        self.version = msg['version']
+        self.latency = None
+        if msg.get('execution_count') != self.execution_count and msg.get('executed'):
+            self.latency = received - msg['executed']
+        self.execution_count = msg.get('execution_count')
+        self.executed = msg.get('executed')
+        self.captured = msg.get('captured')
+        self.sent = msg.get('sent')
+        self.received = received
+
+        return True
+
+    @property
+    def age(self):
+        """ Time since the namespace shown was scanned. None if unknown. """
+
+        if self.captured is None:
+            return None
+
+        return monotonic() - self.captured
@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 22:17:35 CEST
+# Last Modified : dim. 18 oct. 2026 22:17:35 CEST
+"""
+-----------
+DOCSTRING
+
+Registry of the kernels of the runtime directories, for the kernel manager.
+
+The directories are watched with inotify (Linux), or polled every
+POLL_INTERVAL s if inotify is not available. Connection files are only read
+when they appear or change. Kernels are pinged on their heartbeat channel
+every TTL s by a background thread (see heartbeat.py). Spare kernels of kd5 are
+not listed : the pool file is looked at too.
+
+Nothing waits for the pings : kernels not pinged yet are listed as pending
+until the answers come.
+
+poll() is cheap enough to be called at each refresh of the interface : it
+does nothing until a directory changes or new pings were answered. Callbacks
+registered with subscribe() are called when the list changes.
+
+@author: Cyril Desjouy
+"""
+
+import os
+import json
+import errno
+import ctypes
+import ctypes.util
+import logging
+from time import monotonic
+
+from cpyvke.utils.kernel import RUNTIME_DIRS, PENDING, connection_files, kernel_items
+from cpyvke.utils.heartbeat import HeartbeatThread
+from cpyvke.utils.kd import POOL_FILE
+
+logger = logging.getLogger("cpyvke.registry")
+
+
+# inotify_init1 flags and events (sys/inotify.h)
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENTS = (0x00000002 |   # IN_MODIFY
+             0x00000008 |   # IN_CLOSE_WRITE
+             0x00000040 |   # IN_MOVED_FROM
+             0x00000080 |   # IN_MOVED_TO
+             0x00000100 |   # IN_CREATE
+             0x00000200 |   # IN_DELETE
+             0x00000400 |   # IN_DELETE_SELF
+             0x00000800)    # IN_MOVE_SELF
+
+
+class Inotify:
+    """ Tell when the content of some directories changed """
+
+    # Seconds between two attempts to watch directories which do not exist
+    RETRY = 5
+
+    def __init__(self, paths):
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        self.missing = list(paths)
+        self.retried = 0
+        self.watch_missing()
+
+    def watch_missing(self):
+        """ Watch the directories created since the last attempt.
+        Return True if one was. """
+
+        self.retried = monotonic()
+        found = False
+        for path in list(self.missing):
+            if self.add_watch(self.fd, path.encode(), IN_EVENTS) >= 0:
+                self.missing.remove(path)
+                found = True
+
+        return found
+
+    def changed(self):
+        """ True if a watched directory changed since the last call """
+
+        changed = False
+        while True:
+            try:
+                changed |= bool(os.read(self.fd, 4096))
+            except OSError as err:
+                if err.errno == errno.EAGAIN:
+                    break
+                raise
+
+        if self.missing and monotonic() - self.retried > self.RETRY:
+            changed |= self.watch_missing()
+
+        return changed
+
+    def close(self):
+
+        os.close(self.fd)
+
+
+class Poller:
+    """ Tell when the content of some directories changed, from their mtime """
+
+    # Seconds between two checks
+    POLL_INTERVAL = 1
+
+    def __init__(self, paths):
+
+        self.paths = paths
+        self.checked = monotonic()
+        self.mtimes = self.stat()
+
+    def stat(self):
+        """ mtime of each directory (None if missing) """
+
+        mtimes = []
+        for path in self.paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+
+        return mtimes
+
+    def changed(self):
+        """ True if a directory changed since the last check """
+
+        if monotonic() - self.checked < self.POLL_INTERVAL:
+            return False
+
+        self.checked = monotonic()
+        mtimes = self.stat()
+        changed, self.mtimes = mtimes != self.mtimes, mtimes
+
+        return changed
+
+    def close(self):
+
+        pass
+
+
+def watcher(paths):
+    """ Inotify watcher of **paths**, or Poller if inotify is not available """
+
+    try:
+        return Inotify(paths)
+    except (OSError, AttributeError, TypeError):
+        logger.info('inotify not available : runtime directories are polled')
+        return Poller(paths)
+
+
+class KernelRegistry:
+    """ Kernels of the runtime directories and the round trip time of their
+    heartbeat (None if dead) """
+
+    # Seconds between two pings of a kernel
+    TTL = 3
+
+    def __init__(self, paths=RUNTIME_DIRS, ttl=TTL):
+
+        self.paths = paths
+        self.watcher = watcher(paths)
+        self.pool_mtime = mtime(POOL_FILE)
+        self.heartbeat = HeartbeatThread(ttl)
+        # {connection file: (mtime, connection info)}
+        self.files = {}
+        # {connection file: round trip time or None}
+        self.rtts = {}
+        self.listeners = []
+        self.scan()
+        self.probe()
+
+    def subscribe(self, callback):
+        """ Call **callback**(registry) when the list of kernels changes """
+
+        self.listeners.append(callback)
+
+    def poll(self):
+        """ Update the registry. Return True (and call listeners) if it changed. """
+
+        changed = (self.watcher.changed() | self.pool_changed()) and self.scan()
+        changed |= self.probe()
+
+        if changed:
+            for callback in self.listeners:
+                callback(self)
+
+        return changed
+
+    def pool_changed(self):
+        """ True if the spare kernels of kd5 changed since the last call """
+
+        pool_mtime = mtime(POOL_FILE)
+        changed, self.pool_mtime = pool_mtime != self.pool_mtime, pool_mtime
+
+        return changed
+
+    def scan(self):
+        """ Read the connection files which appeared or changed.
+        Return True if the list of files changed. """
+
+        files = {}
+        for cf in connection_files_of(self.paths):
+            try:
+                mtime = os.stat(cf).st_mtime_ns
+                if cf in self.files and self.files[cf][0] == mtime:
+                    files[cf] = self.files[cf]
+                else:
+                    with open(cf) as f:
+                        files[cf] = (mtime, json.load(f))
+            except (OSError, ValueError):
+                # Connection file being written : read on next change
+                continue
+
+        changed = set(files) != set(self.files)
+        reread = any(files[cf] is not self.files.get(cf) for cf in files)
+        self.files = files
+        if changed or reread:
+            self.heartbeat.watch({cf: info for cf, (_, info) in files.items()})
+
+        return changed
+
+    def probe(self):
+        """ Collect the answers of the pings. Return True if one changed. """
+
+        rtts = self.heartbeat.results()
+        changed, self.rtts = rtts != self.rtts, rtts
+
+        return changed
+
+    def expire(self):
+        """ Ping all kernels again """
+
+        self.heartbeat.expire()
+
+    def kernels(self):
+        """ (connection file, round trip time) pairs. Kernels not pinged yet
+        have PENDING. """
+
+        return [(cf, self.rtts.get(cf, PENDING)) for cf in self.files]
+
+    def kernel_dic(self, cf=None):
+        """ Same as utils.kernel.kernel_dic(), without looking at the files """
+
+        return kernel_items(self.kernels(), cf)
+
+    def close(self):
+        """ Stop watching the runtime directories """
+
+        self.watcher.close()
+        self.heartbeat.close()
+
+
+def mtime(path):
+    """ mtime of **path** (None if missing) """
+
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def connection_files_of(paths):
+    """ Connection files of the directories **paths** """
+
+    return [cf for path in paths for cf in connection_files(path)]
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 14:36:52 CEST
+# Last Modified : dim. 18 oct. 2026 14:36:52 CEST
+"""
+-----------
+DOCSTRING
+
+Shared memory transport of arrays ([comm] array-transport = shm).
+
+The kernel agent copies the array once into a segment (publish) and the client
+maps it read-only (attach). The client then asks for the segment to be
+released : the name is unlinked but the mapping stays valid in the client and
+in the plot processes it forks, until they drop the array.
+
+Segments live in /dev/shm : the client and the kernel must run on the same
+host.
+
+@author: Cyril Desjouy
+"""
+
+import os
+import mmap
+import threading
+import numpy as np
+
+
+# Kernel side : published segments not yet released
+PUBLISHED = {}
+LOCK = threading.Lock()
+
+# Published segments kept if the client never releases them
+PUBLISHED_MAX = 4
+
+# Where POSIX shared memory segments appear
+SHM_DIR = '/dev/shm/'
+
+
+def publish(data):
+    """ Copy the contiguous array **data** into a new segment. Return its header. """
+
+    from multiprocessing.shared_memory import SharedMemory
+
+    # Forget segments of a client which never released them
+    with LOCK:
+        stale = list(PUBLISHED)[:max(len(PUBLISHED) - PUBLISHED_MAX + 1, 0)]
+    for name in stale:
+        release(name)
+
+    shm = SharedMemory(create=True, size=max(data.nbytes, 1))
+    copy = np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)
+    copy[...] = data
+    del copy
+    with LOCK:
+        PUBLISHED[shm.name] = shm
+
+    return {'dtype': data.dtype.str,
+            'shape': list(data.shape),
+            'nbytes': data.nbytes,
+            'shm': shm.name}
+
+
+def release(name):
+    """ Unlink the segment **name**. Existing mappings are not affected. """
+
+    with LOCK:
+        shm = PUBLISHED.pop(name, None)
+    if shm:
+        shm.close()
+        shm.unlink()
+
+
+def attach(header):
+    """ Map the segment described by **header** read-only. Return the array. """
+
+    fd = os.open(SHM_DIR + header['shm'].lstrip('/'), os.O_RDONLY)
+    try:
+        buf = mmap.mmap(fd, max(header['nbytes'], 1), prot=mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+    return np.frombuffer(buf, dtype=np.dtype(header['dtype']),
+                         count=int(np.prod(header['shape']))).reshape(header['shape'])
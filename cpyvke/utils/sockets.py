@@ -28,8 +28,42 @@ DOCSTRING
 @author: Cyril Desjouy
 """
 
-import socket
-from cpyvke.utils.comm import send_msg
+import json
+import select
+import numpy as np
+from time import time
+from collections import deque
+from cpyvke.utils import shared
+from cpyvke.utils.comm import send_msg, connect, hello, offer, codecs, FrameDecoder, \
+    FLAG_BINARY, WELCOME
+
+
+class Download:
+    """ Array received in binary frames, written in place as they come. """
+
+    def __init__(self, header):
+
+        self.array = np.empty(header['shape'], dtype=np.dtype(header['dtype']))
+        self.view = memoryview(self.array.reshape(-1).view(np.uint8))
+        self.nbytes = header['nbytes']
+        self.received = 0
+        # Chunks being received
+        self.offset = 0
+        self.pending = deque()
+
+    def chunk(self, size):
+        """ Part of the array buffer where the next **size** bytes go """
+
+        view = self.view[self.offset:self.offset + size]
+        self.offset += size
+        self.pending.append(size)
+
+        return view
+
+    def done(self):
+        """ The oldest chunk being received is complete """
+
+        self.received += self.pending.popleft()
 
 
 class SocketManager:
@@ -39,37 +73,62 @@ class SocketManager:
         self.config = config
         self.logger = logger
         self.connected = False
+        self.rid = 0
+        self.waiting = set()
+        self.replies = {}
+        self.downloads = {}
+        # Codecs negotiated with kd5 on each socket
+        self.codec = None
+        self.request_codec = None
+        # Heartbeat : kd5 is pinged every interval and considered lost if no
+        # pong came for 3 intervals
+        self.heartbeat = float(config['comm'].get('heartbeat', 2))
+        # End-to-end latencies reported to kd5 with the next ping
+        self.latencies = []
         self.init_sockets()
 
     def init_main_socket(self):
         """ Init Main Socket. """
 
         try:
-            hote = "localhost"
             sport = int(self.config['comm']['s-port'])
-            self.MainSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.MainSock.connect((hote, sport))
+            self.MainSock = connect(self.config['comm']['transport'], sport)
+            # The namespace comes without waiting for the welcome (see updates)
+            offer(self.MainSock, self.codecs())
+            self.codec = None
             self.MainSock.setblocking(0)
+            self.main_frames = FrameDecoder(self.MainSock)
             self.logger.debug('Connected to main socket')
-        except ConnectionRefusedError:
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.last_pong = 0
             self.logger.error('Connection to stream socket failed ')
 
     def init_request_socket(self):
         """ Init Request Socket. """
 
         try:
-            hote = "localhost"
             rport = int(self.config['comm']['r-port'])
-            self.RequestSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.RequestSock.connect((hote, rport))
+            self.RequestSock = connect(self.config['comm']['transport'], rport)
+            self.request_codec = hello(self.RequestSock, self.codecs())
             self.RequestSock.setblocking(0)
+            self.request_frames = FrameDecoder(self.RequestSock, self.request_codec,
+                                               into=self.chunk)
             self.logger.debug('Connected to request socket')
         except Exception:
+            self.last_pong = 0
             self.logger.error('Connection to stream socket failed : \n', exc_info=True)
 
+    def codecs(self):
+        """ Codecs offered to kd5 """
+
+        return codecs(self.config['comm']['compression'])
+
     def init_sockets(self):
         """ Init all sockets """
 
+        self.ping = None
+        self.last_ping = 0
+        self.last_pong = time()
         self.init_main_socket()
         self.init_request_socket()
 
@@ -106,15 +165,27 @@ class SocketManager:
         self.init_sockets()
 
     def check_main_socket(self):
-        """ Test if connection to daemon is alive. """
+        """ Test if connection to daemon is alive. Costs nothing between two
+        heartbeats : the state comes from the last pong and from the sockets
+        kd5 closed. """
+
+        now = time()
 
         try:
-            send_msg(self.MainSock, '<TEST>')
-            self.connected = True
-        except BlockingIOError:
-            self.connected = True
-        except OSError:
-            self.connected = False
+            if self.ping is not None:
+                self.read_replies()
+                if self.complete(self.ping):
+                    self.ping = None
+                    self.last_pong = now
+            elif now - self.last_ping >= self.heartbeat:
+                self.ping = self.request('ping', latencies=self.latencies)
+                self.latencies = []
+                self.last_ping = now
+            closed = self.main_frames.closed or self.request_frames.closed
+        except (OSError, AttributeError):
+            closed = True
+
+        self.connected = not closed and now - self.last_pong < 3*self.heartbeat
 
     def warning_socket(self, wng):
         """ Check connection and display warning. """
@@ -125,18 +196,145 @@ class SocketManager:
         else:
             wng.display(' Disconnected from socket ')
 
+    def request(self, rtype, wait_reply=True, **kwargs):
+        """ Send a request to the daemon. Return its id.
+        If **wait_reply** is False, the reply is discarded when received. """
+
+        self.rid += 1
+        kwargs.update(id=self.rid, type=rtype)
+        send_msg(self.RequestSock, json.dumps(kwargs))
+        if wait_reply:
+            self.waiting.add(self.rid)
+
+        return self.rid
+
+    def reply(self, rid, timeout=0):
+        """ Reply to request **rid** or None if not received within **timeout** s.
+        Replies to other requests received meanwhile are kept.
+        Replies to array requests come with the 'array' once complete. """
+
+        deadline = time() + timeout
+        while True:
+            self.read_replies()
+            reply = self.complete(rid)
+            remaining = deadline - time()
+            if reply or remaining <= 0:
+                return reply
+            try:
+                select.select([self.RequestSock], [], [], remaining)
+            except (OSError, ValueError):
+                return None
+
+    def read_replies(self):
+        """ Read what kd5 sent on the request socket """
+
+        try:
+            for flags, payload in self.request_frames.read():
+                if flags & FLAG_BINARY:
+                    if payload in self.downloads:
+                        self.downloads[payload].done()
+                    continue
+
+                reply = json.loads(payload.decode('utf8'))
+                if reply['id'] not in self.waiting:
+                    continue
+
+                self.replies[reply['id']] = reply
+                if 'shm' in reply:
+                    self.attach(reply)
+                elif 'nbytes' in reply:
+                    self.downloads[reply['id']] = Download(reply)
+                else:
+                    # Transfer interrupted
+                    self.downloads.pop(reply['id'], None)
+        except OSError:
+            pass
+
+    def complete(self, rid):
+        """ Reply to request **rid** if it is complete, None otherwise """
+
+        download = self.downloads.get(rid)
+        if download and download.received < download.nbytes:
+            return None
+
+        if rid in self.replies:
+            self.waiting.discard(rid)
+            reply = self.replies.pop(rid)
+            if download:
+                reply['array'] = self.downloads.pop(rid).array
+            return reply
+
+        return None
+
+    def attach(self, reply):
+        """ Map the shared memory segment of an array reply, then release it """
+
+        try:
+            reply['array'] = shared.attach(reply)
+        except OSError as err:
+            self.logger.error('Cannot map shared array', exc_info=True)
+            reply.update(status='error', error=str(err))
+
+        self.request('release', wait_reply=False, shm=reply['shm'])
+
+    def chunk(self, rid, size):
+        """ Where a binary frame of **size** bytes for request **rid** goes :
+        directly into the array it belongs to """
+
+        if rid in self.downloads:
+            return self.downloads[rid].chunk(size)
+
+        return memoryview(bytearray(size))
+
+    def updates(self):
+        """ Namespace messages received on the main socket.
+        Raise OSError if the connection to kd5 is lost. """
+
+        updates = []
+        for flags, payload in self.main_frames.read():
+            if payload.startswith(WELCOME):
+                # The next frames may be compressed with the codec kd5 chose
+                self.codec = json.loads(payload.decode('utf8'))['codec']
+                self.main_frames.codec = self.codec
+            else:
+                updates.append(payload.decode('utf8'))
+
+        return updates
+
+    def progress(self, rid):
+        """ (received, nbytes) of the array requested by **rid** or None """
+
+        if rid in self.downloads:
+            return self.downloads[rid].received, self.downloads[rid].nbytes
+
+        return None
+
+    def subscribe(self, cf):
+        """ Switch to the kernel of connection file **cf**. Requests and
+        namespace updates then concern this kernel. """
+
+        self.request('kernel', wait_reply=False, cf=cf)
+        send_msg(self.MainSock, json.dumps({'type': 'subscribe', 'cf': cf}))
+
     def force_update(self, wng):
-        """ Force update of variable list sending fake code to Daemon """
+        """ Force update of variable list """
 
-        send_msg(self.RequestSock, '<code> ')
+        self.resync()
         wng.display('Reloading Variable List...')
 
+    def resync(self):
+        """ Ask the daemon for a full snapshot of the namespace """
+
+        try:
+            self.request('resync', wait_reply=False)
+        except Exception:
+            self.logger.error('Resync :', exc_info=True)
+
     def del_var(self, varname, wng):
         """ Delete a variable from kernel. """
 
-        code = 'del {}'.format(varname)
         try:
-            send_msg(self.RequestSock, '<code>' + code)
+            self.request('delete', wait_reply=False, name=varname)
             self.logger.debug("Send delete signal for variable {}".format(varname))
         except Exception:
             self.logger.error('Delete variable :', exc_info=True)
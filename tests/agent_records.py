@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 23:48:12 CEST
+# Last Modified : dim. 18 oct. 2026 23:48:12 CEST
+"""
+-----------
+DOCSTRING
+
+Records cached by the agent between scans follow in place changes.
+
+Each case creates a variable, scans it, changes it in place and checks that
+the next scan shows the change, as a scan without cache would.
+
+    python3 tests/agent_records.py
+
+@author: Cyril Desjouy
+"""
+
+from cpyvke.utils import agent
+
+
+class Frame:
+    """ Array-like object without dtype, whose preview is its repr """
+
+    def __init__(self, values):
+        self.values = values
+        self.shape = (len(values),)
+
+    def __repr__(self):
+        return 'Frame({})'.format(self.values)
+
+
+def scan(namespace):
+    """ Records of **namespace**, as agent.snapshot() builds them """
+
+    cache = {}
+    records = {name: agent.cached_summary(value, cache)
+               for name, value in namespace.items()}
+    agent.CACHE = cache
+
+    return records
+
+
+def check(name, value, change):
+    """ Scan **value**, apply **change** to it and scan again """
+
+    namespace = {name: value}
+    scan(namespace)
+    change(value)
+    cached = scan(namespace)[name]
+    agent.CACHE = {}
+    fresh = agent.summary(value)
+
+    status = 'ok' if cached == fresh else 'FAILED'
+    print('{:<24} {:<6} {}'.format(name, status, cached['value']))
+
+    return cached == fresh
+
+
+def main():
+
+    def setitem(key, item):
+        def change(value):
+            value[key] = item
+        return change
+
+    def nested(item):
+        def change(value):
+            value[0][0][0][0] = item
+        return change
+
+    def frame(value):
+        value.values[0] = 2
+
+    cases = [('hash collision', [-1], setitem(0, -2)),
+             ('signed zero', [0.0], setitem(0, -0.0)),
+             ('deep nesting', [[[[1]]]], nested(2)),
+             ('deeper nesting', [[[[[[1]]]]]], lambda v: v[0][0][0][0][0].append(2)),
+             ('shown dict key', {k: 0 for k in 'zyxwvutsrqpo'}, setitem('o', 1)),
+             ('shown set item', set(range(8, 100)), lambda v: v.add(-1) or v.remove(99)),
+             ('shape without dtype', Frame([1]), frame)]
+
+    results = [check(*case) for case in cases]
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
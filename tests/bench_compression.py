@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2016-2018 Cyril Desjouy <ipselium@free.fr>
+#
+# This file is part of cpyvke
+#
+# cpyvke is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# cpyvke is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with cpyvke. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Creation Date : dim. 18 oct. 2026 19:04:26 CEST
+# Last Modified : dim. 18 oct. 2026 19:04:26 CEST
+"""
+-----------
+DOCSTRING
+
+Break-even size of frame compression.
+
+Namespace messages of growing size are framed with and without each codec of
+comm.CODECS, then sent through a unix socket pair. For a link of a given
+bandwidth, compression pays off once the time it takes (compress + decompress)
+is less than the time saved on the wire.
+
+    python3 tests/bench_compression.py
+
+@author: Cyril Desjouy
+"""
+
+import time
+import socket
+import threading
+import numpy as np
+
+from cpyvke.utils.agent import summary
+from cpyvke.utils.comm import frame, recv_msg, CODECS
+from cpyvke.utils.namespace import Snapshot
+
+# Links compared (bytes/s)
+LINKS = {'unix socket': None,
+         '1 Gbit/s': 125e6,
+         '100 Mbit/s': 12.5e6}
+
+REPEAT = 20
+
+
+def namespace(n):
+    """ Snapshot message of a namespace of **n** variables """
+
+    values = [1, 2.5, 'some text', list(range(20)), {'a': 1, 'b': [1, 2]},
+              np.zeros((50, 50)), np.arange(10), None]
+    snapshot = Snapshot()
+    snapshot.update({'var{}'.format(i): summary(values[i % len(values)])
+                     for i in range(n)})
+
+    return snapshot.full().encode('utf8')
+
+
+def best(func, *args):
+    """ Best time of **func** over REPEAT runs """
+
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def transfer(data, codec):
+    """ Time to frame, send, receive and decode **data** on a socket pair """
+
+    a, b = socket.socketpair()
+
+    def send():
+        a.sendall(frame(data, codec=codec, threshold=0))
+
+    def run():
+        thread = threading.Thread(target=send)
+        thread.start()
+        recv_msg(b, codec)
+        thread.join()
+
+    elapsed = best(run)
+    a.close()
+    b.close()
+
+    return elapsed
+
+
+def main():
+
+    print('{:>9} {:>6} {:>10} {:>6} {:>9} {:>9} {:>10} {:>10}'.format(
+        'size', 'codec', 'compressed', 'ratio', 'comp ms', 'dec ms',
+        'raw ms', 'codec ms'))
+
+    gains = {(codec, link): [] for codec in CODECS for link in LINKS}
+
+    for n in (5, 20, 50, 100, 200, 500, 1000, 2000, 5000, 20000):
+        data = namespace(n)
+        raw = transfer(data, None)
+
+        for codec, (compress, decompress) in CODECS.items():
+            packed = compress(data)
+            comp = best(compress, data)
+            dec = best(decompress, packed)
+            total = transfer(data, codec)
+            print('{:>9} {:>6} {:>10} {:>6.2f} {:>9.3f} {:>9.3f} {:>10.3f} {:>10.3f}'.format(
+                len(data), codec, len(packed), len(data)/len(packed),
+                1e3*comp, 1e3*dec, 1e3*raw, 1e3*total))
+
+            for link, bandwidth in LINKS.items():
+                if bandwidth is None:
+                    gain = raw - total
+                else:
+                    gain = (len(data) - len(packed))/bandwidth - comp - dec
+                gains[codec, link].append((len(data), gain))
+
+    print('\nBreak-even size (compression pays off above) :')
+    for (codec, link), results in gains.items():
+        sizes = [size for size, gain in results if gain > 0]
+        if sizes and all(gain > 0 for size, gain in results if size >= sizes[0]):
+            found = '{} bytes'.format(sizes[0])
+        elif sizes:
+            found = 'irregular : {}'.format(sizes)
+        else:
+            found = 'never'
+        print('  {:>6} over {:<12} : {}'.format(codec, link, found))
+
+
+if __name__ == '__main__':
+    main()
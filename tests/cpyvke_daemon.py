@@ -35,8 +35,7 @@ import logging
 from cpyvke.utils.sockets import SocketManager
 from cpyvke.utils.config import cfg_setup
 from logging.handlers import RotatingFileHandler
-from cpyvke.utils.comm import recv_msg
-from cpyvke.utils.display import whos_to_dic
+from cpyvke.utils.namespace import Namespace
 
 cfg = cfg_setup()
 config = cfg.run()
@@ -58,6 +57,7 @@ logger.addHandler(handler)
 
 
 sock = SocketManager(config, logger)
+namespace = Namespace()
 
 while True:
     # Check Connection to daemon
@@ -76,20 +76,16 @@ while True:
 
     else:
         try:
-            tmp = recv_msg(sock.MainSock).decode('utf8')
-        except BlockingIOError:     # If no message !
-            pass
+            updates = sock.updates()
         except OSError:             # If user disconnect cpyvke from socket
-            pass
+            updates = []
         except AttributeError:      # If kd5 is stopped
-            pass
-        else:
-            if tmp:
-                lst = whos_to_dic(tmp)
+            updates = []
+
+        for tmp in updates:
+            if namespace.apply(tmp):
                 logger.info('Variable list updated')
                 logger.debug('\n%s', tmp)
-                try:
-                    # remove temporary file used by daemon from the list
-                    del lst['fcpyvke0']
-                except KeyError:
-                    pass
+            else:
+                sock.resync()
+                break